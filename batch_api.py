@@ -0,0 +1,71 @@
+import os
+import asyncio
+import orjson
+
+# Batch API helpers shared by the pipeline stages that send requests in bulk
+
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+POLL_INTERVAL = 30
+MAX_POLL_INTERVAL = 120
+
+async def submit_batch(client, jsonl_path, endpoint="/v1/chat/completions"):
+    """
+    Upload a JSONL file of requests and start a Batch API job for them.
+    
+    Batch requests are billed at half the price of synchronous requests.
+    
+    Args:
+        client: OpenAI API client
+        jsonl_path (str): Path to the JSONL file with one request per line
+        endpoint (str): API endpoint the requests are sent to
+    
+    Returns:
+        str: ID of the created batch
+    """
+    with open(jsonl_path, "rb") as f:
+        batch_file = await client.files.create(
+            file=(os.path.basename(jsonl_path), f, "application/jsonl"),
+            purpose="batch"
+        )
+    
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=endpoint,
+        completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id} from {jsonl_path}")
+    return batch.id
+
+async def poll_batch(client, batch_id, poll=POLL_INTERVAL, max_poll=MAX_POLL_INTERVAL):
+    """
+    Wait for a batch to finish and collect its results.
+    
+    The wait between status checks doubles after each check, up to max_poll.
+    
+    Args:
+        client: OpenAI API client
+        batch_id (str): ID of the batch to wait for
+        poll (int): Seconds to wait before the first status check
+        max_poll (int): Maximum number of seconds between status checks
+    
+    Returns:
+        dict: The "response" object (status_code and body) of each output line,
+            keyed by custom_id. Requests that failed or never ran are missing
+    """
+    while True:
+        batch = await client.batches.retrieve(batch_id)
+        print(f"Batch {batch_id} status: {batch.status} ({batch.request_counts.completed}/{batch.request_counts.total})")
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            break
+        await asyncio.sleep(poll)
+        poll = min(poll * 2, max_poll)
+    
+    results = {}
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.content.splitlines():
+            if line.strip():
+                result = orjson.loads(line)
+                results[result["custom_id"]] = result.get("response") or {}
+    
+    return results
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite")
+CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 30 * 24 * 3600))
+
+_conn = None
+
+def _connect():
+    """
+    Open the cache database on first use.
+    
+    The connection is created lazily so that each worker process opens its own.
+    
+    Returns:
+        sqlite3.Connection: Connection to the cache database
+    """
+    global _conn
+    
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                hash TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at INTEGER,
+                expires_at INTEGER
+            )
+        """)
+        _conn.commit()
+    
+    return _conn
+
+def enabled():
+    """Whether the cache is in use; set LLM_CACHE_ENABLED=0 to bypass it."""
+    return os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+
+def make_key(model, messages, temperature, max_tokens, response_format=None):
+    """
+    Build the cache key for a chat completion request.
+    
+    Args:
+        model (str): Model name
+        messages (list): Chat messages sent to the model
+        temperature (float): Sampling temperature
+        max_tokens (int): Maximum number of tokens to generate
+        response_format (dict): JSON schema of the structured output format, if any
+    
+    Returns:
+        str: SHA-256 hex digest identifying the request
+    """
+    payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+    if response_format:
+        payload["response_format"] = response_format
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def make_embedding_key(model, text):
+    """
+    Build the cache key for an embedding of a single text.
+    
+    Args:
+        model (str): Embedding model name
+        text (str): Text that is embedded
+    
+    Returns:
+        str: SHA-256 hex digest identifying the request
+    """
+    payload = {"model": model, "input": text}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def make_url_key(url):
+    """
+    Build the cache key for an HTTP GET of a URL.
+    
+    Args:
+        url (str): Requested URL, including the query string
+    
+    Returns:
+        str: SHA-256 hex digest identifying the request
+    """
+    payload = {"url": url}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def get(key):
+    """
+    Look up a cached response.
+    
+    Args:
+        key (str): Key from make_key
+    
+    Returns:
+        str: The cached response, or None if missing or expired
+    """
+    row = _connect().execute(
+        "SELECT response FROM llm_cache WHERE hash = ? AND expires_at > ?",
+        (key, int(time.time()))
+    ).fetchone()
+    
+    return row[0] if row else None
+
+def set(key, value, model=None, ttl=CACHE_TTL):
+    """
+    Store a response in the cache.
+    
+    Args:
+        key (str): Key from make_key
+        value (str): Response content to store
+        model (str): Model that produced the response
+        ttl (int): Number of seconds the entry stays valid
+    """
+    now = int(time.time())
+    conn = _connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_cache (hash, model, response, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+        (key, model, value, now, now + ttl)
+    )
+    conn.commit()
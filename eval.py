@@ -1,11 +1,189 @@
 import os
 import json
 import argparse
-import time
+import asyncio
+import functools
+import hashlib
+import importlib.util
 import random
-from tqdm import tqdm
-from openai import OpenAI
-from anthropic import Anthropic
+from typing import Literal
+import httpx
+import numpy as np
+import orjson
+from pydantic import BaseModel, ConfigDict, ValidationError
+from tqdm.asyncio import tqdm
+import openai
+import anthropic
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+from batch_api import submit_batch, poll_batch, POLL_INTERVAL
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# HTTP/2 needs the h2 package; without it the shared client uses HTTP/1.1
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+class Verdict(BaseModel):
+    """Structured output returned by the judge model."""
+    model_config = ConfigDict(extra="forbid")
+    
+    correctness: str
+    winner: Literal["first", "second"]
+    reasoning: str
+
+RATE_LIMIT_ERRORS = (openai.RateLimitError, anthropic.RateLimitError)
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError, openai.InternalServerError,
+    anthropic.APIConnectionError, anthropic.InternalServerError
+)
+
+SYSTEM_PROMPT = "\nRespond in the following format:\n<reasoning>\n...\n</reasoning>\n<answer>\n...\n</answer>\n"
+
+JUDGE_PROMPT_TEMPLATE = """
+You are an impartial judge evaluating the quality of responses to a mathematical reasoning question.
+
+QUESTION:
+{question}
+
+REFERENCE ANSWER:
+{reference_answer}
+
+FIRST RESPONSE ({first_model}):
+{first_response}
+
+SECOND RESPONSE ({second_model}):
+{second_response}
+
+Follow these strict evaluation criteria to determine a winner (there must be a winner, no ties allowed):
+
+1. CORRECTNESS: First, determine if each answer is mathematically correct based on the reference answer.
+   
+   - If BOTH answers are correct (match the reference answer in mathematical substance):
+     * The more CONCISE answer wins. Evaluate based on brevity while still maintaining clarity.
+   
+   - If ONE answer is correct and the other is wrong:
+     * The correct answer WINS.
+   
+   - If BOTH answers are wrong:
+     * The answer that makes more progress toward the correct solution wins.
+     * The answer with fewer mathematical errors wins.
+
+Your evaluation must be fair and unbiased. You MUST choose a winner - no ties allowed.
+
+OUTPUT FORMAT:
+Provide your evaluation as a JSON object with these fields:
+correctness: [Are both answers correct? Is one correct and one wrong? Are both wrong?]
+winner: ["first" or "second"]
+reasoning: [brief explanation of your decision based on the criteria above]
+"""
+
+def disk_cache(dir=".eval_cache", key_fn=None):
+    """
+    Cache the string results of an async API call on disk.
+    
+    Entries are stored as {dir}/{key[:2]}/{key}.json, where key is the SHA-256 of
+    the JSON returned by key_fn. Calls that raise are not cached.
+    Set EVAL_CACHE_ENABLED=0 to bypass the cache and EVAL_CACHE_FORCE_REFRESH=1 to
+    ignore existing entries and overwrite them.
+    
+    Args:
+        dir (str): Directory to store cache entries in
+        key_fn (callable): Called with the wrapped function's arguments, returns
+            a JSON-serializable value identifying the request
+        
+    Returns:
+        callable: Decorator for async functions returning str
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if os.environ.get("EVAL_CACHE_ENABLED", "1") == "0":
+                return await fn(*args, **kwargs)
+            
+            key_data = json.dumps(key_fn(*args, **kwargs), sort_keys=True)
+            key = hashlib.sha256(key_data.encode()).hexdigest()
+            path = os.path.join(dir, key[:2], f"{key}.json")
+            
+            if os.environ.get("EVAL_CACHE_FORCE_REFRESH", "0") != "1" and os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        return json.load(f)["response"]
+                except Exception as e:
+                    print(f"Error reading cache entry {path}: {e}")
+            
+            response = await fn(*args, **kwargs)
+            
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({"response": response}, f)
+            
+            return response
+        return wrapper
+    return decorator
+
+class SemanticJudgeCache:
+    """
+    Reuse judge verdicts for prompts that are nearly identical in meaning.
+    
+    Judge prompts are embedded with text-embedding-3-small and stored in a FAISS
+    inner-product index over normalized vectors, so the search score is the cosine
+    similarity. The winning model's name is stored rather than 'first'/'second',
+    since a prompt with the two responses swapped embeds almost identically.
+    """
+    
+    def __init__(self, path=".eval_cache/semantic", threshold=0.95, dimension=1536):
+        if faiss is None:
+            raise ValueError("The semantic cache requires faiss. Install it with 'pip install faiss-cpu'.")
+        
+        self.index_path = path + ".index"
+        self.winners_path = path + ".json"
+        self.threshold = threshold
+        
+        if os.path.exists(self.index_path) and os.path.exists(self.winners_path):
+            self.index = faiss.read_index(self.index_path)
+            with open(self.winners_path, 'r') as f:
+                self.winners = json.load(f)
+            print(f"Loaded {len(self.winners)} semantic cache entries from {self.index_path}")
+        else:
+            self.index = faiss.IndexFlatIP(dimension)
+            self.winners = []
+    
+    async def embed(self, client, prompt):
+        """Return the normalized embedding of a prompt, or None if embedding fails."""
+        try:
+            response = await client.embeddings.create(model="text-embedding-3-small", input=prompt)
+        except Exception as e:
+            print(f"Error embedding judge prompt: {e}")
+            return None
+        
+        vector = np.array([response.data[0].embedding], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+    
+    def lookup(self, vector):
+        """Return the winning model name cached for the closest prompt, if similar enough."""
+        if vector is None or self.index.ntotal == 0:
+            return None
+        
+        scores, ids = self.index.search(vector, 1)
+        if scores[0][0] >= self.threshold:
+            return self.winners[ids[0][0]]
+        return None
+    
+    def add(self, vector, winner_model):
+        if vector is None:
+            return
+        self.index.add(vector)
+        self.winners.append(winner_model)
+    
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        faiss.write_index(self.index, self.index_path)
+        with open(self.winners_path, 'w') as f:
+            json.dump(self.winners, f)
 
 def load_evaluation_dataset(file_path="eval_dataset.json"):
     """
@@ -15,82 +193,155 @@ def load_evaluation_dataset(file_path="eval_dataset.json"):
         file_path (str): Path to the evaluation dataset JSON file
         
     Returns:
-        list: List of question-answer pairs
+        tuple: (questions, answers), two tuples of strings in dataset order
     """
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
+        questions = tuple(e['question'] for e in data)
+        answers = tuple(e['answer'] for e in data)
         print(f"Loaded {len(data)} evaluation examples from {file_path}")
-        return data
+        return questions, answers
     except Exception as e:
         print(f"Error loading evaluation dataset: {e}")
-        return []
+        return (), ()
+
+async def iterate_examples(questions, answers):
+    """Yield (question, answer) pairs from a dataset loaded with load_evaluation_dataset."""
+    for pair in zip(questions, answers):
+        yield pair
+
+async def load_evaluation_dataset_stream(file_path="eval_dataset.jsonl"):
+    """
+    Read a JSONL evaluation dataset one line at a time.
+    
+    Args:
+        file_path (str): Path to a JSONL file with one question-answer pair per line
+        
+    Yields:
+        tuple: (question, answer) for each line of the file
+    """
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            example = orjson.loads(line)
+            yield example['question'], example['answer']
+
+def retry_after_seconds(error):
+    """Return the delay requested by a rate-limited response's Retry-After header, if any."""
+    try:
+        return float(error.response.headers["retry-after"])
+    except (AttributeError, KeyError, ValueError):
+        return None
+
+async def get_openai_completion(client, model_name, question):
+    """Ask an OpenAI chat model (including fine-tuned models) a question."""
+    response = await client.chat.completions.create(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": question}
+        ],
+        temperature=0.2,
+        max_tokens=2000
+    )
+    return response.choices[0].message.content
+
+async def get_anthropic_completion(client, model_name, question):
+    """Ask an Anthropic model a question."""
+    response = await client.messages.create(
+        model=model_name,
+        system=SYSTEM_PROMPT,
+        messages=[
+            {"role": "user", "content": question}
+        ],
+        max_tokens=2000
+    )
+    return response.content[0].text
 
-def get_model_response(client, model_name, question, max_retries=3, retry_delay=2):
+@disk_cache(key_fn=lambda complete, client, model_name, question, *args, **kwargs: {
+    "model": model_name, "system": SYSTEM_PROMPT, "user": question, "temp": 0.2
+})
+async def get_model_response(complete, client, model_name, question, max_retries=3, retry_delay=2):
     """
     Get a response from a model for a given question.
     
     Args:
+        complete (callable): Provider-specific completion function, e.g. get_openai_completion
         client: API client (OpenAI or Anthropic)
         model_name (str): Name of the model to use
         question (str): Question to ask the model
-        max_retries (int): Maximum number of retries on failure
-        retry_delay (int): Delay between retries in seconds
+        max_retries (int): Maximum number of attempts on rate limit or transient errors
+        retry_delay (int): Base delay between retries in seconds, doubled after each attempt;
+            rate-limited calls wait for the Retry-After header instead when it is present
         
     Returns:
         str: Model's response
+        
+    Raises:
+        Exception: The last API error if every attempt failed, or any non-transient error
+    """
+    for attempt in range(max_retries):
+        try:
+            return await complete(client, model_name, question)
+        except RATE_LIMIT_ERRORS as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = retry_delay * 2 ** attempt
+        except TRANSIENT_ERRORS:
+            if attempt == max_retries - 1:
+                raise
+            delay = retry_delay * 2 ** attempt + random.uniform(0, 1)
+        
+        await asyncio.sleep(delay)
+
+def _make_caller(model_name, openai_client, anthropic_client):
     """
-    system_prompt = "\nRespond in the following format:\n<reasoning>\n...\n</reasoning>\n<answer>\n...\n</answer>\n"
+    Resolve which API serves a model, once per evaluation run.
     
-    try:
-        if "gpt" in model_name.lower() or "ft:" in model_name:
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.2,
-                max_tokens=2000
-            )
-            return response.choices[0].message.content
-        
-        elif "claude" in model_name.lower():
-            response = client.messages.create(
-                model=model_name,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": question}
-                ],
-                max_tokens=2000
-            )
-            return response.content[0].text
+    Args:
+        model_name (str): Name of the model
+        openai_client: OpenAI API client
+        anthropic_client: Anthropic API client (None if no Claude model is used)
         
-        else:
-            raise ValueError(f"Unsupported model: {model_name}")
-                
-    except Exception as e:
-        print(f"Error getting response from {model_name}: {e}")
-        return f"Error: Failed to get response from {model_name}."
+    Returns:
+        callable: Async function taking a question and returning the model's response
+        
+    Raises:
+        ValueError: If the model is not served by either API
+    """
+    if "gpt" in model_name.lower() or "ft:" in model_name:
+        complete, client = get_openai_completion, openai_client
+    elif "claude" in model_name.lower():
+        complete, client = get_anthropic_completion, anthropic_client
+    else:
+        raise ValueError(f"Unsupported model: {model_name}")
+    
+    async def call(question):
+        return await get_model_response(complete, client, model_name, question)
+    
+    return call
 
-def judge_responses(client, question, reference_answer, model_a_response, model_b_response, model_a_name, model_b_name):
+def build_judge_prompt(question, reference_answer, model_a_response, model_b_response, model_a_name, model_b_name, swap):
     """
-    Use GPT-4o as a judge to determine which model's response is better.
+    Build the judge prompt for a pair of responses.
     
     Args:
-        client: OpenAI API client
         question (str): The original question
         reference_answer (str): The reference answer from the dataset
         model_a_response (str): Response from model A
         model_b_response (str): Response from model B
         model_a_name (str): Name of model A
         model_b_name (str): Name of model B
+        swap (bool): Present model B's response first
         
     Returns:
-        str: 'A' if model A's response is better, 'B' if model B's response is better
+        tuple: (prompt, mapping) where mapping translates 'first'/'second' to 'A'/'B'
     """
-    # Normal judging process
-    if random.random() < 0.5:
+    if not swap:
         first_response = model_a_response
         second_response = model_b_response
         first_model = model_a_name
@@ -103,86 +354,225 @@ def judge_responses(client, question, reference_answer, model_a_response, model_
         second_model = model_a_name
         mapping = {'first': 'B', 'second': 'A'}
     
-    prompt = f"""
-You are an impartial judge evaluating the quality of responses to a mathematical reasoning question.
-
-QUESTION:
-{question}
-
-REFERENCE ANSWER:
-{reference_answer}
-
-FIRST RESPONSE ({first_model}):
-{first_response}
-
-SECOND RESPONSE ({second_model}):
-{second_response}
-
-Follow these strict evaluation criteria to determine a winner (there must be a winner, no ties allowed):
-
-1. CORRECTNESS: First, determine if each answer is mathematically correct based on the reference answer.
-
-   - If BOTH answers are correct (match the reference answer in mathematical substance):
-     * The more CONCISE answer wins. Evaluate based on brevity while still maintaining clarity.
-
-   - If ONE answer is correct and the other is wrong:
-     * The correct answer WINS.
+    prompt = JUDGE_PROMPT_TEMPLATE.format(
+        question=question,
+        reference_answer=reference_answer,
+        first_model=first_model,
+        first_response=first_response,
+        second_model=second_model,
+        second_response=second_response
+    )
+    
+    return prompt, mapping
 
-   - If BOTH answers are wrong:
-     * The answer that makes more progress toward the correct solution wins.
-     * The answer with fewer mathematical errors wins.
+def parse_verdict(content, mapping):
+    """
+    Extract the winner from the judge's structured output.
+    
+    Args:
+        content (str): The judge's response, a JSON object matching Verdict
+        mapping (dict): Mapping from 'first'/'second' to 'A'/'B'
+        
+    Returns:
+        str: 'A' or 'B', or None if the response is not a valid verdict
+    """
+    try:
+        verdict = Verdict.model_validate_json(content)
+    except ValidationError as e:
+        print(f"Error parsing judge verdict: {e}")
+        return None
+    
+    return mapping[verdict.winner]
 
-Your evaluation must be fair and unbiased. You MUST choose a winner - no ties allowed.
+@disk_cache(key_fn=lambda client, prompt: {"model": "gpt-4o", "prompt": prompt, "temp": 0.2, "format": "verdict"})
+async def get_judge_completion(client, prompt):
+    """
+    Get the judge model's verdict for a judge prompt.
+    
+    Args:
+        client: OpenAI API client
+        prompt (str): Judge prompt built by build_judge_prompt
+        
+    Returns:
+        str: The judge's verdict as a JSON object matching Verdict
+    """
+    response = await client.beta.chat.completions.parse(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": prompt}],
+        response_format=Verdict,
+        temperature=0.2,
+        max_tokens=256
+    )
+    
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise ValueError(f"Judge did not return a verdict: {message.refusal}")
+    
+    return message.content
 
-OUTPUT FORMAT:
-Provide your evaluation in the following format:
-CORRECTNESS ASSESSMENT: [Are both answers correct? Is one correct and one wrong? Are both wrong?]
-WINNER: [first/second]
-REASONING: [brief explanation of your decision based on the criteria above]
-"""
+async def judge_responses(client, question, reference_answer, model_a_response, model_b_response, model_a_name, model_b_name, swap, semantic_cache=None):
+    """
+    Use GPT-4o as a judge to determine which model's response is better.
+    
+    Args:
+        client: OpenAI API client
+        question (str): The original question
+        reference_answer (str): The reference answer from the dataset
+        model_a_response (str): Response from model A
+        model_b_response (str): Response from model B
+        model_a_name (str): Name of model A
+        model_b_name (str): Name of model B
+        swap (bool): Present model B's response to the judge first
+        semantic_cache (SemanticJudgeCache): Cache of judge outputs for similar prompts (optional)
+        
+    Returns:
+        str: 'A' if model A's response is better, 'B' if model B's response is better,
+            or None if the judge failed
+    """
+    prompt, mapping = build_judge_prompt(question, reference_answer, model_a_response, model_b_response, model_a_name, model_b_name, swap)
+    
+    model_names = {'A': model_a_name, 'B': model_b_name}
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=2000
-        )
-        
-        content = response.choices[0].message.content
-        
-        if "WINNER: first" in content:
-            return mapping['first']
-        elif "WINNER: second" in content:
-            return mapping['second']
-        else:
-            # Fallback in case the format isn't followed exactly
-            if "first" in content.lower() and "better" in content.lower():
-                return mapping['first']
-            elif "second" in content.lower() and "better" in content.lower():
-                return mapping['second']
-            else:
-                # If we can't determine a winner, randomly choose one
-                return random.choice([mapping['first'], mapping['second']])
+        if semantic_cache is None:
+            content = await get_judge_completion(client, prompt)
+            return parse_verdict(content, mapping)
+        
+        vector = await semantic_cache.embed(client, prompt)
+        cached_model = semantic_cache.lookup(vector)
+        for winner, name in model_names.items():
+            if cached_model == name:
+                return winner
+        
+        content = await get_judge_completion(client, prompt)
+        winner = parse_verdict(content, mapping)
+        if winner is not None:
+            semantic_cache.add(vector, model_names[winner])
+        return winner
             
     except Exception as e:
         print(f"Error in judging responses: {e}")
-        # In case of error, randomly choose a winner
-        return random.choice([mapping['first'], mapping['second']])
+        return None
+
+async def judge_responses_batch(client, judge_inputs, batch_path="judge_batch.jsonl", poll_interval=POLL_INTERVAL):
+    """
+    Judge many response pairs at once through the OpenAI Batch API.
+    
+    Batch requests are billed at half price but may take up to 24 hours, so this
+    is meant for evaluations where results are only needed at the end.
+    
+    Args:
+        client: OpenAI API client
+        judge_inputs (list): Tuples of (question, reference_answer, model_a_response,
+            model_b_response, model_a_name, model_b_name, swap)
+        batch_path (str): Path to write the batch request file to
+        poll_interval (int): Seconds to wait before the first batch status check
+        
+    Returns:
+        list: 'A', 'B' or None (no valid verdict) for each input, in the same order
+    """
+    prompts = [build_judge_prompt(*judge_input) for judge_input in judge_inputs]
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": "Verdict", "strict": True, "schema": Verdict.model_json_schema()}
+    }
+    
+    with open(batch_path, 'wb') as f:
+        for i, (prompt, _) in enumerate(prompts):
+            f.write(orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o",
+                    "messages": [{"role": "user", "content": prompt}],
+                    "response_format": response_format,
+                    "temperature": 0.2,
+                    "max_tokens": 256
+                }
+            }, option=orjson.OPT_APPEND_NEWLINE))
+    
+    batch_id = await submit_batch(client, batch_path)
+    results = await poll_batch(client, batch_id, poll=poll_interval)
+    
+    winners = []
+    for i, (_, mapping) in enumerate(prompts):
+        response = results.get(str(i), {})
+        if response.get("status_code") != 200:
+            print(f"Error in judging responses: no batch result for request {i}")
+            winners.append(None)
+        else:
+            winners.append(parse_verdict(response["body"]["choices"][0]["message"]["content"], mapping))
+    
+    return winners
+
+def question_hash(question):
+    """Return a stable identifier for an evaluation question."""
+    return hashlib.sha256(question.encode()).hexdigest()
+
+def load_completed_examples(details_file):
+    """
+    Read the per-example results written by a previous run.
+    
+    Args:
+        details_file (str): Path to the JSONL file of per-example results
+        
+    Returns:
+        tuple: (set of question hashes already evaluated, dict of win/error counts)
+    """
+    completed = set()
+    counts = {'model_a_wins': 0, 'model_b_wins': 0, 'errors': 0}
+    
+    if not os.path.exists(details_file):
+        return completed, counts
+    
+    with open(details_file, 'rb') as f:
+        for line in f:
+            try:
+                row = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # A crash can leave a partially written last line
+                continue
+            
+            completed.add(question_hash(row['question']))
+            if row['winner'] == 'A':
+                counts['model_a_wins'] += 1
+            elif row['winner'] == 'B':
+                counts['model_b_wins'] += 1
+            else:
+                counts['errors'] += 1
+    
+    return completed, counts
 
-def evaluate_models(eval_dataset, model_a, model_b, openai_api_key=None, anthropic_api_key=None, num_examples=None, start_index=0, output_file=None):
+async def evaluate_models(examples, model_a, model_b, openai_api_key=None, anthropic_api_key=None, num_examples=None, output_file=None, max_concurrency=16, judge_mode="sync", semantic_cache=False, seed=0xC0FFEE, total_examples=None):
     """
     Evaluate two models on the evaluation dataset.
     
+    Examples are read from `examples` into a bounded queue consumed by
+    max_concurrency workers, so evaluation starts while the dataset is still being
+    read. Each worker requests both model responses for an example at the same
+    time. In batch judge mode all responses are collected first and then judged in
+    a single OpenAI Batch API job.
+    
+    When output_file is given, each example's result is appended to
+    output_file + ".jsonl" as soon as it is judged, and examples already present
+    in that file are skipped, so an interrupted run can simply be restarted.
+    
     Args:
-        eval_dataset (list): List of question-answer pairs
+        examples: Async iterable of (question, reference_answer) pairs
         model_a (str): Name of model A (e.g., "gpt-4o" or a fine-tuned model ID)
         model_b (str): Name of model B (e.g., "claude-3-7-sonnet-20240307")
         openai_api_key (str): OpenAI API key
         anthropic_api_key (str): Anthropic API key
         num_examples (int): Number of examples to evaluate (if None, evaluate all)
-        start_index (int): Index to start evaluation from (skip first start_index examples)
-        output_file (str): Path to save detailed results (if None, don't save)
+        output_file (str): Path to save the results summary (if None, don't save)
+        max_concurrency (int): Maximum number of examples evaluated at the same time
+        judge_mode (str): 'sync' to judge each example as it completes, 'batch' to
+            judge all examples with the OpenAI Batch API
+        semantic_cache (bool): Reuse judge outputs for semantically near-identical
+            prompts (sync judge mode only)
+        seed (int): Seed for the order in which responses are shown to the judge
+        total_examples (int): Size of the dataset if known, for the progress bar
         
     Returns:
         dict: Evaluation results
@@ -193,70 +583,174 @@ def evaluate_models(eval_dataset, model_a, model_b, openai_api_key=None, anthrop
     if not openai_api_key:
         raise ValueError("OpenAI API key not provided. Please set OPENAI_API_KEY environment variable or use the --openai_api_key argument.")
     
-    openai_client = OpenAI(api_key=openai_api_key)
-    
-    anthropic_client = None
-    if "claude" in model_a.lower() or "claude" in model_b.lower():
+    uses_claude = "claude" in model_a.lower() or "claude" in model_b.lower()
+    if uses_claude:
         if not anthropic_api_key:
             anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
         
         if not anthropic_api_key:
             raise ValueError("Anthropic API key not provided but Claude model requested. Please set ANTHROPIC_API_KEY environment variable or use the --anthropic_api_key argument.")
-        
-        anthropic_client = Anthropic(api_key=anthropic_api_key)
     
-    # Skip the first start_index examples
-    if start_index > 0:
-        if start_index >= len(eval_dataset):
-            raise ValueError(f"Start index {start_index} is greater than or equal to the dataset size {len(eval_dataset)}")
-        eval_dataset = eval_dataset[start_index:]
-        print(f"Skipping first {start_index} examples. Starting from example {start_index+1}.")
-    
-    if num_examples and num_examples < len(eval_dataset):
-        eval_dataset = eval_dataset[:num_examples]
+    judge_cache = SemanticJudgeCache() if semantic_cache and judge_mode == "sync" else None
     
     results = {
         'model_a_wins': 0,
         'model_b_wins': 0,
         'ties': 0,
-        'errors': 0,
-        'details': []
+        'errors': 0
     }
     
-    print(f"Evaluating {model_a} vs {model_b} on {len(eval_dataset)} examples...")
+    already_done = set()
+    details_file = output_file + ".jsonl" if output_file else None
     
-    for i, example in enumerate(tqdm(eval_dataset, desc="Evaluating")):
-        question = example['question']
-        reference_answer = example['answer']
-        
-        model_a_client = anthropic_client if "claude" in model_a.lower() else openai_client
-        model_b_client = anthropic_client if "claude" in model_b.lower() else openai_client
-        
-        model_a_response = get_model_response(model_a_client, model_a, question)
-        time.sleep(1)  # Small delay between API calls
-        model_b_response = get_model_response(model_b_client, model_b, question)
-        time.sleep(1)  # Small delay between API calls
-        
-        winner = judge_responses(openai_client, question, reference_answer, model_a_response, model_b_response, model_a, model_b)
-        
-        if winner == 'A':
+    if details_file:
+        already_done, counts = load_completed_examples(details_file)
+        if already_done:
+            results.update(counts)
+            print(f"Found {len(already_done)} examples already evaluated in {details_file}. Skipping them.")
+    
+    expected = None
+    if total_examples is not None:
+        expected = max(total_examples - len(already_done), 0)
+        if num_examples:
+            expected = min(expected, num_examples)
+    
+    def record(detail):
+        if detail['winner'] == 'A':
             results['model_a_wins'] += 1
-        elif winner == 'B':
+        elif detail['winner'] == 'B':
             results['model_b_wins'] += 1
         else:
+            # A failed judgement is counted but not written to the details file,
+            # so that a rerun judges the example again
             results['errors'] += 1
+            return
+        
+        if details_out:
+            details_out.write(orjson.dumps(detail, option=orjson.OPT_APPEND_NEWLINE))
+    
+    # One connection pool shared by both SDKs, so concurrent requests reuse a few
+    # long-lived connections (multiplexed when HTTP/2 is available) instead of
+    # new TLS handshakes
+    http_client = httpx.AsyncClient(
+        http2=HTTP2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+    
+    async with http_client:
+        openai_client = AsyncOpenAI(api_key=openai_api_key, http_client=http_client)
+        anthropic_client = AsyncAnthropic(api_key=anthropic_api_key, http_client=http_client) if uses_claude else None
+        
+        call_a = _make_caller(model_a, openai_client, anthropic_client)
+        call_b = _make_caller(model_b, openai_client, anthropic_client)
+        
+        queue = asyncio.Queue(maxsize=64)
+        pending_judgement = []
+        
+        async def produce():
+            # Swap decisions are drawn per dataset index (skipped examples included)
+            # in blocks from a seeded generator, so that judge prompts are
+            # reproducible across runs and resumes
+            rng = np.random.default_rng(seed)
+            queued = 0
+            i = 0
+            
+            async for question, reference_answer in examples:
+                if i % 1024 == 0:
+                    swap_block = rng.random(1024) < 0.5
+                swap = bool(swap_block[i % 1024])
+                i += 1
+                
+                if question_hash(question) in already_done:
+                    continue
+                if num_examples and queued >= num_examples:
+                    break
+                
+                await queue.put((i, question, reference_answer, swap))
+                queued += 1
+            
+            pbar.total = queued
+            pbar.refresh()
+            
+            for _ in range(max_concurrency):
+                await queue.put(None)
         
-        results['details'].append({
-            'question': question,
-            'reference_answer': reference_answer,
-            'model_a_response': model_a_response,
-            'model_b_response': model_b_response,
-            'winner': winner
-        })
+        async def process_example(i, question, reference_answer, swap):
+            try:
+                model_a_response, model_b_response = await asyncio.gather(call_a(question), call_b(question))
+            except Exception as e:
+                print(f"Error getting model responses for example {i}: {e}")
+                return None
+            
+            if judge_mode == "sync":
+                winner = await judge_responses(openai_client, question, reference_answer, model_a_response, model_b_response, model_a, model_b, swap, judge_cache)
+            else:
+                winner = None
+            
+            return {
+                'question': question,
+                'reference_answer': reference_answer,
+                'model_a_response': model_a_response,
+                'model_b_response': model_b_response,
+                'winner': winner
+            }
         
-        if (i + 1) % 10 == 0:
-            print(f"Progress: {i + 1}/{len(eval_dataset)} examples evaluated")
-            print(f"Current scores: {model_a}: {results['model_a_wins']}, {model_b}: {results['model_b_wins']}")
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                
+                detail = await process_example(*item)
+                pbar.update(1)
+                
+                if detail is None:
+                    # Not written to the details file, so that a rerun retries the example
+                    results['errors'] += 1
+                    continue
+                
+                if judge_mode == "batch":
+                    pending_judgement.append((item[3], detail))
+                    continue
+                
+                record(detail)
+                pbar.set_postfix(a=results['model_a_wins'], b=results['model_b_wins'], refresh=False)
+        
+        print(f"Evaluating {model_a} vs {model_b} (max concurrency: {max_concurrency})...")
+        
+        # Unbuffered so that every result line reaches the file as soon as it is written
+        details_out = open(details_file, 'ab', buffering=0) if details_file else None
+        
+        # smoothing=0 reports the overall average rate, and mininterval limits
+        # redraws so the bar doesn't get in the way of the concurrent requests
+        pbar = tqdm(total=expected, desc="Evaluating", smoothing=0, mininterval=0.5)
+        
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(produce())
+                for _ in range(max_concurrency):
+                    tasks.create_task(worker())
+            
+            pbar.close()
+            
+            if pending_judgement:
+                judge_inputs = [
+                    (d['question'], d['reference_answer'], d['model_a_response'], d['model_b_response'], model_a, model_b, swap)
+                    for swap, d in pending_judgement
+                ]
+                batch_path = output_file + ".judge_batch.jsonl" if output_file else "judge_batch.jsonl"
+                winners = await judge_responses_batch(openai_client, judge_inputs, batch_path)
+                
+                for (_, detail), winner in zip(pending_judgement, winners):
+                    detail['winner'] = winner
+                    record(detail)
+        finally:
+            pbar.close()
+            if details_out:
+                details_out.close()
+            if judge_cache is not None:
+                judge_cache.save()
     
     total = results['model_a_wins'] + results['model_b_wins']
     if total > 0:
@@ -269,40 +763,93 @@ def evaluate_models(eval_dataset, model_a, model_b, openai_api_key=None, anthrop
     print(f"Errors: {results['errors']}")
     
     if output_file:
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
-        print(f"Detailed results saved to {output_file}")
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+        print(f"Results summary saved to {output_file}")
+        print(f"Per-example results saved to {details_file}")
     
     return results
 
+def run_evaluation(eval_dataset="eval_dataset.json", model_a="gpt-4o", model_b="claude-3-7-sonnet-20240307",
+                   openai_api_key=None, anthropic_api_key=None, num_examples=None, output_file=None,
+                   max_concurrency=16, judge_mode="sync", semantic_cache=False, seed=0xC0FFEE):
+    """
+    Load an evaluation dataset and evaluate two models on it.
+    
+    Args:
+        eval_dataset (str): Path to the evaluation dataset JSON file, or a JSONL file to stream examples from
+        model_a (str): First model name
+        model_b (str): Second model name
+        openai_api_key (str): OpenAI API key
+        anthropic_api_key (str): Anthropic API key
+        num_examples (int): Number of examples to evaluate (None for all)
+        output_file (str): Path to save the results summary
+        max_concurrency (int): Maximum number of examples evaluated concurrently
+        judge_mode (str): "sync" to judge as responses complete, "batch" to use the Batch API
+        semantic_cache (bool): Whether to reuse verdicts for near-identical judge prompts
+        seed (int): Seed for the order in which responses are shown to the judge
+        
+    Returns:
+        dict: Evaluation results, or None if the dataset is empty
+    """
+    if eval_dataset.endswith(".jsonl"):
+        examples = load_evaluation_dataset_stream(eval_dataset)
+        total_examples = None
+    else:
+        questions, answers = load_evaluation_dataset(eval_dataset)
+        
+        if not questions:
+            print("No evaluation examples found. Exiting.")
+            return
+        
+        examples = iterate_examples(questions, answers)
+        total_examples = len(questions)
+    
+    return asyncio.run(evaluate_models(
+        examples,
+        model_a,
+        model_b,
+        openai_api_key,
+        anthropic_api_key,
+        num_examples,
+        output_file,
+        max_concurrency,
+        judge_mode,
+        semantic_cache,
+        seed,
+        total_examples
+    ))
+
 def main():
     parser = argparse.ArgumentParser(description="Evaluate fine-tuned models against baseline models")
     parser.add_argument("--model_a", default="gpt-4o", help="Model A name (e.g., 'gpt-4o' or a fine-tuned model ID)")
     parser.add_argument("--model_b", default="claude-3-7-sonnet-20240307", help="Model B name (e.g., 'claude-3-7-sonnet-20240307')")
-    parser.add_argument("--eval_dataset", default="eval_dataset.json", help="Path to the evaluation dataset JSON file")
+    parser.add_argument("--eval_dataset", default="eval_dataset.json", help="Path to the evaluation dataset JSON file, or a JSONL file to stream examples from")
     parser.add_argument("--openai_api_key", help="OpenAI API key (if not provided, will use OPENAI_API_KEY environment variable)")
     parser.add_argument("--anthropic_api_key", help="Anthropic API key (if not provided, will use ANTHROPIC_API_KEY environment variable)")
     parser.add_argument("--num_examples", type=int, help="Number of examples to evaluate (if not provided, evaluate all)")
-    parser.add_argument("--start", type=int, default=0, help="Index to start evaluation from (skip first N examples)")
-    parser.add_argument("--output_file", help="Path to save detailed results (if not provided, don't save)")
+    parser.add_argument("--output_file", help="Path to save the results summary; per-example results are streamed to <output_file>.jsonl and used to resume interrupted runs (if not provided, don't save)")
+    parser.add_argument("--max_concurrency", type=int, default=16, help="Maximum number of examples evaluated concurrently (default: 16)")
+    parser.add_argument("--judge_mode", choices=["sync", "batch"], default="sync",
+                        help="Judge each example as it completes ('sync') or all at once via the OpenAI Batch API at half cost ('batch')")
+    parser.add_argument("--semantic_cache", action="store_true",
+                        help="Reuse judge verdicts for semantically near-identical judge prompts (requires faiss, sync judge mode only)")
+    parser.add_argument("--seed", type=int, default=0xC0FFEE, help="Seed for the order in which responses are shown to the judge")
     
     args = parser.parse_args()
     
-    eval_dataset = load_evaluation_dataset(args.eval_dataset)
-    
-    if not eval_dataset:
-        print("No evaluation examples found. Exiting.")
-        return
-    
-    evaluate_models(
-        eval_dataset,
+    run_evaluation(
+        args.eval_dataset,
         args.model_a,
         args.model_b,
         args.openai_api_key,
         args.anthropic_api_key,
         args.num_examples,
-        args.start,
-        args.output_file
+        args.output_file,
+        args.max_concurrency,
+        args.judge_mode,
+        args.semantic_cache,
+        args.seed
     )
 
 if __name__ == "__main__":
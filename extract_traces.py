@@ -1,95 +1,571 @@
 import os
 import argparse
-import json
-import time
-import sys
+import orjson
+import asyncio
+import random
+import hashlib
 import re
+import time
 import glob
-from PyPDF2 import PdfReader
-from openai import OpenAI
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pypdfium2 as pdfium
+import tiktoken
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel, ConfigDict, ValidationError
+import cache
+from batch_api import submit_batch, poll_batch
 import pandas as pd
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
+
+try:
+    from datasketch import MinHash, MinHashLSH
+except ImportError:
+    MinHashLSH = None
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("EXTRACT_MAX_CONCURRENT_REQUESTS", 5))
+CHUNKS_PER_REQUEST = 3
+
+# Sizes in gpt-4o tokens. Papers longer than MAX_FULL_TEXT_TOKENS are chunked
+CHUNK_TOKENS = 6000
+CHUNK_OVERLAP_TOKENS = 400
+MAX_FULL_TEXT_TOKENS = 15000
+
+# Starting rate limits, replaced by the x-ratelimit-limit-* headers of the first response
+RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", 500))
+TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", 30000))
+
+# AIMD concurrency control: +0.5 while the rolling average latency stays under the
+# target, x0.5 on a slow average, 429 or server error. The target is well above
+# typical chat latencies because extraction requests generate thousands of tokens
+TARGET_LATENCY = float(os.environ.get("EXTRACT_TARGET_LATENCY", 60))
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 32
+LATENCY_WINDOW = 10
+
+# Seconds without a new request before the collected requests are sent as a batch
+BATCH_FLUSH_DELAY = 1.0
+
+# Formatted QA pairs of every processed PDF, keyed by its content and the extraction
+# settings, so a PDF seen before is not sent to the model again
+TRACE_CACHE_DIR = os.environ.get("TRACE_CACHE_DIR", os.path.join("cache", "traces"))
+# Part of the cache key; bump when the prompts change so that stale pairs are not
+# served. Changes to the QAPair schema invalidate entries on their own
+TRACE_CACHE_VERSION = "v1"
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+CROSS_CHUNK_SIMILARITY_THRESHOLD = 0.75
+# Tokens of each of the two chunks included in a cross-chunk merge prompt
+CROSS_CHUNK_CONTEXT_TOKENS = 2000
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+
+# Prompt prefixes hold everything that is the same for every request, so that the
+# repeated part of each prompt comes first and is eligible for OpenAI prompt caching.
+# The paper-specific context and text are appended after them
+PROMPT_EXTRACT_METADATA_PREFIX = """
+Extract key metadata from this academic paper. Focus on:
+1. The paper's title
+2. The main topic/field
+3. The key mathematical or algorithmic contributions
+4. Any named theorems, algorithms, or models introduced
+"""
+
+PROMPT_EXTRACT_FULL_TEXT_PREFIX = """
+You are an expert at extracting challenging MATHEMATICAL REASONING problems from academic papers.
+
+Extract question-answer pairs from the academic paper given at the end.
+FOCUS EXCLUSIVELY on mathematical content that requires PROOF, DERIVATION, or COMPLEX REASONING.
+
+PRIORITIZE questions that require:
+1. Proving mathematical theorems, lemmas, or properties
+2. Deriving equations or formulas
+3. Analyzing algorithm complexity with mathematical reasoning
+4. Solving optimization problems step-by-step
+5. Formal mathematical arguments and logical deductions
+
+DO NOT include questions that:
+- Simply ask for facts or information from the paper
+- Can be answered without mathematical reasoning
+- Are about general concepts without requiring proof or derivation
+
+IMPORTANT: The questions should be formulated in a GENERIC way that doesn't require access to the paper.
+Instead of saying "Prove Theorem 3.2 from the paper", say "Given that [state the theorem], prove that..."
+
+Each question MUST:
+- Require mathematical reasoning, proof, or derivation to solve
+- Include all necessary context from the paper
+- Be self-contained with all required information
+- Capture complete chains of mathematical reasoning
+
+The answer should provide a detailed, step-by-step mathematical solution with proper notation.
+The final_answer should state only the final result or conclusion of that solution in one or two sentences.
+
+Try to extract 10-15 high-quality MATHEMATICAL REASONING question-answer pairs.
+
+EXAMPLES:
+[
+    {
+        "question": "Given that a telescope network scheduling problem can be formulated as an integer linear program with variables x_ij representing whether observation i is scheduled at time j, prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once.",
+        "answer": "To prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once, we need to analyze what this constraint means mathematically... [detailed mathematical reasoning]",
+        "final_answer": "Each observation i appears in at most one term x_ij = 1, so it is scheduled at most once."
+    },
+    {
+        "question": "Derive the time complexity of the dynamic programming algorithm for solving the telescope scheduling problem with n observations and m time slots, and prove its correctness.",
+        "answer": "To derive the time complexity, we analyze each step of the algorithm... [step-by-step mathematical derivation]",
+        "final_answer": "The algorithm runs in O(nm) time and returns an optimal schedule."
+    },
+    ...
+]
+"""
+
+PROMPT_EXTRACT_CHUNK_PREFIX = """
+You are an expert at extracting challenging MATHEMATICAL REASONING problems from academic papers.
+
+Extract question-answer pairs from each of the chunks of text from a specific paper given at the end.
+FOCUS EXCLUSIVELY on mathematical content that requires PROOF, DERIVATION, or COMPLEX REASONING.
+
+PRIORITIZE questions that require:
+1. Proving mathematical theorems, lemmas, or properties
+2. Deriving equations or formulas
+3. Analyzing algorithm complexity with mathematical reasoning
+4. Solving optimization problems step-by-step
+5. Formal mathematical arguments and logical deductions
+
+DO NOT include questions that:
+- Simply ask for facts or information from the paper
+- Can be answered without mathematical reasoning
+- Are about general concepts without requiring proof or derivation
+
+IMPORTANT: The questions should be formulated in a GENERIC way that doesn't require access to the paper.
+Instead of saying "Prove Theorem 3.2 from the paper", say "Given that [state the theorem], prove that..."
+
+Each question MUST:
+- Require mathematical reasoning, proof, or derivation to solve
+- Include all necessary context from the paper
+- Be self-contained with all required information
+
+The answer should provide a detailed, step-by-step mathematical solution with proper notation.
+The final_answer should state only the final result or conclusion of that solution in one or two sentences.
+
+If a chunk contains part of a proof or algorithm that continues from a previous chunk or extends to the next chunk, create questions that focus on the complete parts visible in that chunk.
+
+Try to extract 3-5 high-quality MATHEMATICAL REASONING question-answer pairs from each chunk if possible.
+Return one entry per chunk, with "chunk" set to the chunk number shown in its heading.
 
-def extract_text_from_pdf(pdf_path):
+EXAMPLES:
+[
+    {
+        "question": "Given that a telescope network scheduling problem can be formulated as an integer linear program with variables x_ij representing whether observation i is scheduled at time j, prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once.",
+        "answer": "To prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once, we need to analyze what this constraint means mathematically... [detailed mathematical reasoning]",
+        "final_answer": "Each observation i appears in at most one term x_ij = 1, so it is scheduled at most once."
+    },
+    {
+        "question": "Derive the time complexity of the dynamic programming algorithm for solving the telescope scheduling problem with n observations and m time slots, and prove its correctness.",
+        "answer": "To derive the time complexity, we analyze each step of the algorithm... [step-by-step mathematical derivation]",
+        "final_answer": "The algorithm runs in O(nm) time and returns an optimal schedule."
+    },
+    ...
+]
+"""
+
+class ExtractionError(Exception):
+    """An extraction request failed, so the pairs of the PDF would be incomplete."""
+
+class PaperMetadata(BaseModel):
+    """Structured output of the metadata extraction request."""
+    model_config = ConfigDict(extra="forbid")
+    
+    title: str
+    field: str
+    contributions: list[str]
+    named_elements: list[str]
+
+class QAPair(BaseModel):
+    """A single extracted question-answer pair."""
+    model_config = ConfigDict(extra="forbid")
+    
+    question: str
+    answer: str
+    final_answer: str
+
+class QAList(BaseModel):
+    """Structured output of the question-answer extraction requests."""
+    model_config = ConfigDict(extra="forbid")
+    
+    items: list[QAPair]
+
+class ChunkQAPairs(BaseModel):
+    """Question-answer pairs extracted from one chunk of a batched request."""
+    model_config = ConfigDict(extra="forbid")
+    
+    chunk: int
+    items: list[QAPair]
+
+class ChunkQAList(BaseModel):
+    """Structured output of a batched chunk extraction request."""
+    model_config = ConfigDict(extra="forbid")
+    
+    chunks: list[ChunkQAPairs]
+
+# Errors worth retrying; anything else (bad request, auth, ...) fails on the first attempt
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# Below this many pages, starting extra processes costs more than it saves
+PARALLEL_PAGE_THRESHOLD = 20
+
+def _extract_page_range(pdf_path, start, stop):
+    pdf = pdfium.PdfDocument(pdf_path)
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return [pdf[i].get_textpage().get_text_range() for i in range(start, stop)]
+    finally:
+        pdf.close()
+
+def extract_text_from_pdf(pdf_path, page_workers=1):
+    try:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page_count = len(pdf)
+            if page_workers <= 1 or page_count <= PARALLEL_PAGE_THRESHOLD:
+                return "\n".join(page.get_textpage().get_text_range() for page in pdf) + "\n"
+        finally:
+            pdf.close()
+        
+        # PDFium is not thread-safe, so large documents are split into page ranges
+        # that are decoded in separate processes, each with its own copy of the document
+        step = -(-page_count // page_workers)
+        with ProcessPoolExecutor(max_workers=page_workers) as executor:
+            futures = [executor.submit(_extract_page_range, pdf_path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            return "\n".join(text for future in futures for text in future.result()) + "\n"
     except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
-        sys.exit(1)
+        print(f"Error extracting text from PDF {pdf_path}: {e}")
+        return ""
+
+# Exponential backoff with jitter, overridden by the server's Retry-After header when present
+async def _call_with_backoff(fn, *args, max_retries=5, max_delay=60, **kwargs):
+    for attempt in range(max_retries):
+        try:
+            return await fn(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries - 1:
+                raise
+            
+            delay = min(2 ** attempt + random.uniform(0, 1), max_delay)
+            
+            response = getattr(e, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    pass
+            
+            print(f"{type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+# Structured chat completion, validated into response_format and served from the
+# on-disk response cache when possible. refresh=True skips the lookup, e.g. when
+# retrying a response that failed validation
+async def _cached_completion(client, model, messages, temperature, max_tokens, response_format, refresh=False):
+    use_cache = cache.enabled()
+    key = cache.make_key(model, messages, temperature, max_tokens, response_format.model_json_schema())
+    
+    if use_cache and not refresh:
+        content = cache.get(key)
+        if content is not None:
+            return response_format.model_validate_json(content)
+    
+    response = await _call_with_backoff(
+        client.parse_completion,
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        response_format=response_format
+    )
+    content = response.choices[0].message.content
+    parsed = response_format.model_validate_json(content)
+    
+    if use_cache:
+        cache.set(key, content, model)
+    
+    return parsed
 
-def chunk_text(text, max_chunk_size=8000, overlap=500):
+def _parse_reset(value):
+    # Rate limit reset durations look like "1s", "6m0s" or "20ms"
+    seconds = 0.0
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value or ""):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+class ThrottledClient:
+    """
+    AsyncOpenAI wrapper that keeps requests under the account's rate limits.
+    
+    Requests are bounded by an adaptive (AIMD) concurrency limit and by a 60-second
+    sliding window of request and estimated token counts. The x-ratelimit-* headers of every response
+    update the limits, and when fewer than 10% of the requests or tokens remain
+    new requests wait for the reported reset time.
+    
+    When `processes` worker processes each run their own client, every client keeps
+    to its 1/processes share of the account's request and token budget.
+    """
+    
+    def __init__(self, client, max_concurrent=MAX_CONCURRENT_REQUESTS, rpm_limit=RPM_LIMIT, tpm_limit=TPM_LIMIT, processes=1):
+        self.client = client
+        self.processes = max(processes, 1)
+        self.concurrency = float(min(max(max_concurrent, MIN_CONCURRENCY), MAX_CONCURRENCY))
+        self.in_flight = 0
+        self.slot_available = asyncio.Condition()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.rpm_limit = rpm_limit / self.processes
+        self.tpm_limit = tpm_limit / self.processes
+        self.window = deque()
+        self.paused_until = 0.0
+    
+    async def _wait_if_throttled(self, estimated_tokens):
+        while True:
+            now = time.monotonic()
+            while self.window and self.window[0][0] <= now - 60:
+                self.window.popleft()
+            
+            if self.paused_until > now:
+                wait = self.paused_until - now
+            elif self.window and (len(self.window) >= self.rpm_limit or sum(tokens for _, tokens in self.window) + estimated_tokens > self.tpm_limit):
+                wait = self.window[0][0] + 60 - now
+            else:
+                self.window.append((now, estimated_tokens))
+                return
+            
+            # Re-check at least every second, since a response may raise the limits
+            await asyncio.sleep(min(wait, 1.0))
+    
+    def _update_from_headers(self, headers):
+        try:
+            limit_requests = int(headers.get("x-ratelimit-limit-requests", self.rpm_limit * self.processes))
+            limit_tokens = int(headers.get("x-ratelimit-limit-tokens", self.tpm_limit * self.processes))
+            remaining_requests = int(headers.get("x-ratelimit-remaining-requests", limit_requests))
+            remaining_tokens = int(headers.get("x-ratelimit-remaining-tokens", limit_tokens))
+        except ValueError:
+            return
+        
+        # The headers report the whole account's limits, so the window gets this
+        # process's share; the remaining counts are account-wide and used as they are
+        self.rpm_limit = limit_requests / self.processes
+        self.tpm_limit = limit_tokens / self.processes
+        
+        pause = 0.0
+        if remaining_requests <= max(2, 0.1 * limit_requests):
+            pause = max(pause, _parse_reset(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tokens < 0.1 * limit_tokens:
+            pause = max(pause, _parse_reset(headers.get("x-ratelimit-reset-tokens")))
+        if headers.get("retry-after"):
+            try:
+                pause = max(pause, float(headers["retry-after"]))
+            except ValueError:
+                pass
+        
+        if pause:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+    
+    async def _acquire_slot(self):
+        async with self.slot_available:
+            await self.slot_available.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+    
+    async def _release_slot(self, latency=None, overloaded=False):
+        async with self.slot_available:
+            self.in_flight -= 1
+            
+            if latency is not None:
+                self.latencies.append(latency)
+            
+            if overloaded or (self.latencies and sum(self.latencies) / len(self.latencies) > TARGET_LATENCY):
+                self.concurrency = max(MIN_CONCURRENCY, self.concurrency * 0.5)
+            elif latency is not None:
+                self.concurrency = min(MAX_CONCURRENCY, self.concurrency + 0.5)
+            
+            self.slot_available.notify_all()
+    
+    async def _request(self, method, estimated_tokens, **kwargs):
+        await self._acquire_slot()
+        latency = None
+        overloaded = False
+        
+        try:
+            await self._wait_if_throttled(estimated_tokens)
+            started = time.monotonic()
+            try:
+                raw_response = await method(**kwargs)
+            except openai.APIStatusError as e:
+                # 429s carry the same headers; pause before the retry is attempted
+                self._update_from_headers(e.response.headers)
+                overloaded = isinstance(e, (openai.RateLimitError, openai.InternalServerError))
+                raise
+            latency = time.monotonic() - started
+            self._update_from_headers(raw_response.headers)
+            return raw_response.parse()
+        finally:
+            await self._release_slot(latency, overloaded)
+    
+    async def parse_completion(self, **kwargs):
+        # Roughly 4 characters per token for the prompt, plus the completion budget
+        prompt_chars = sum(len(message["content"]) for message in kwargs["messages"])
+        estimated_tokens = prompt_chars // 4 + kwargs.get("max_tokens", 0)
+        return await self._request(self.client.beta.chat.completions.with_raw_response.parse, estimated_tokens, **kwargs)
+    
+    async def create_embeddings(self, **kwargs):
+        estimated_tokens = sum(len(text) for text in kwargs["input"]) // 4
+        return await self._request(self.client.embeddings.with_raw_response.create, estimated_tokens, **kwargs)
+
+class BatchCollector:
+    """
+    Groups the chat completion requests of many PDFs into OpenAI Batch API jobs.
+    
+    Batch requests cost half as much as synchronous ones but may take up to 24 hours.
+    A batch is submitted once no new request has arrived for flush_delay seconds,
+    that is once every PDF's pipeline is waiting on a response, so each extraction
+    step of all PDFs goes out as one batch. The request files are kept in batch_dir,
+    with custom_ids of the form <label>-<n> mapping each line back to its PDF.
+    """
+    
+    def __init__(self, client, batch_dir, flush_delay=BATCH_FLUSH_DELAY):
+        self.client = client
+        self.batch_dir = batch_dir
+        self.flush_delay = flush_delay
+        self.pending = []
+        self.batch_count = 0
+        self.flusher = None
+    
+    async def submit(self, custom_id, body):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((custom_id, body, future))
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_when_idle())
+        return await future
+    
+    async def _flush_when_idle(self):
+        while self.pending:
+            count = len(self.pending)
+            await asyncio.sleep(self.flush_delay)
+            if len(self.pending) != count:
+                continue
+            
+            requests, self.pending = self.pending, []
+            try:
+                results = await self._run_batch(requests)
+            except Exception as e:
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+            
+            for custom_id, _, future in requests:
+                response = results.get(custom_id, {})
+                if response.get("status_code") == 200:
+                    future.set_result(ChatCompletion.model_validate(response["body"]))
+                else:
+                    future.set_exception(RuntimeError(f"Batch request {custom_id} failed: {response.get('body') or 'no result'}"))
+    
+    async def _run_batch(self, requests):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        self.batch_count += 1
+        path = os.path.join(self.batch_dir, f"requests{self.batch_count}.jsonl")
+        
+        with open(path, 'wb', buffering=1 << 20) as f:
+            for custom_id, body, _ in requests:
+                f.write(orjson.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}, option=orjson.OPT_APPEND_NEWLINE))
+        
+        batch_id = await submit_batch(self.client, path)
+        return await poll_batch(self.client, batch_id)
+
+class BatchClient:
+    """Per-PDF view of a BatchCollector with the same interface as ThrottledClient."""
+    
+    def __init__(self, collector, label):
+        self.collector = collector
+        self.label = label
+        self.request_count = 0
+    
+    async def parse_completion(self, **kwargs):
+        response_format = kwargs.pop("response_format")
+        body = {
+            **kwargs,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": response_format.__name__, "strict": True, "schema": response_format.model_json_schema()}
+            }
+        }
+        
+        self.request_count += 1
+        return await self.collector.submit(f"{self.label}-{self.request_count}", body)
+    
+    async def create_embeddings(self, **kwargs):
+        # Embedding requests are small and cheap, so they are not batched
+        return await self.collector.client.embeddings.create(**kwargs)
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding():
+    return tiktoken.encoding_for_model("gpt-4o")
+
+def count_tokens(text):
+    return len(_get_encoding().encode(text))
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    encoding = _get_encoding()
+    tokens = encoding.encode(text)
+    
+    # Indices of tokens containing a period or newline, so each chunk can end at a
+    # sentence or line break found by binary search
+    split_positions = np.array([i for i, token in enumerate(encoding.decode_tokens_bytes(tokens)) if b"." in token or b"\n" in token], dtype=np.int64)
+    
     chunks = []
     start = 0
-    while start < len(text):
-        end = min(start + max_chunk_size, len(text))
-        if end < len(text) and end - start == max_chunk_size:
-            last_period = text.rfind(".", start, end)
-            last_newline = text.rfind("\n", start, end)
-            end = max(last_period, last_newline)
-            if end <= start:
-                end = start + max_chunk_size
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        if end < len(tokens):
+            idx = np.searchsorted(split_positions, end, side='left') - 1
+            # Only move the boundary if the next chunk still starts after this one
+            if idx >= 0 and split_positions[idx] + 1 > start + overlap_tokens:
+                end = int(split_positions[idx]) + 1
         
-        chunks.append(text[start:end])
-        start = end - overlap if end < len(text) else end
+        chunks.append(encoding.decode(tokens[start:end]))
+        start = end - overlap_tokens if end < len(tokens) else end
     
     return chunks
 
-def extract_paper_metadata(text, client, model="gpt-4o-mini"):
-    prompt = f"""
-    Extract key metadata from this academic paper. Focus on:
-    1. The paper's title
-    2. The main topic/field
-    3. The key mathematical or algorithmic contributions
-    4. Any named theorems, algorithms, or models introduced
-    
-    Format your response as a JSON object with these fields.
-    
-    TEXT (first part of the paper):
-    {text[:5000]}
-    
-    OUTPUT FORMAT:
-    {{
-        "title": "Paper title",
-        "field": "Main field/topic",
-        "contributions": ["Key contribution 1", "Key contribution 2", ...],
-        "named_elements": ["Theorem/Algorithm/Model name 1", "Theorem/Algorithm/Model name 2", ...]
-    }}
-    """
+# Keeps the first (or with from_end, the last) max_tokens tokens of text
+def truncate_tokens(text, max_tokens, from_end=False):
+    encoding = _get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens])
+
+async def extract_paper_metadata(text, client, model="gpt-4o-mini"):
+    prompt = PROMPT_EXTRACT_METADATA_PREFIX + f"\nTEXT (first part of the paper):\n{text[:5000]}\n"
     
     try:
-        response = client.chat.completions.create(
+        metadata = await _cached_completion(
+            client,
             model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
-            max_tokens=1000
+            max_tokens=1000,
+            response_format=PaperMetadata
         )
-        
-        content = response.choices[0].message.content
-        
-        try:
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            
-            if start_idx >= 0 and end_idx > start_idx:
-                json_str = content[start_idx:end_idx]
-                metadata = json.loads(json_str)
-                return metadata
-            else:
-                print("Error: Could not find JSON object in metadata response")
-                return {}
-        except json.JSONDecodeError:
-            print("Error: Failed to parse JSON from metadata response")
-            return {}
-            
+        return metadata.model_dump()
+    
+    except ValidationError as e:
+        raise ExtractionError("Failed to parse metadata response") from e
     except Exception as e:
-        print(f"Error calling OpenAI API for metadata extraction: {e}")
-        return {}
+        raise ExtractionError(f"Error calling OpenAI API for metadata extraction: {e}") from e
 
-def extract_qa_pairs_from_full_text(text, metadata, client, model="gpt-4o", max_retries=3, retry_delay=2):
+async def extract_qa_pairs_from_full_text(text, metadata, client, model="gpt-4o", max_retries=3, retry_delay=2):
     context = f"Title: {metadata.get('title', 'Unknown')}\n"
     context += f"Field: {metadata.get('field', 'Operations Research')}\n"
     
@@ -99,106 +575,35 @@ def extract_qa_pairs_from_full_text(text, metadata, client, model="gpt-4o", max_
     if metadata.get('named_elements'):
         context += f"Named theorems/algorithms: {', '.join(metadata.get('named_elements', []))}\n"
     
-    max_text_length = 60000
-    if len(text) > max_text_length:
-        text = text[:max_text_length]
+    tokens = _get_encoding().encode(text)
+    if len(tokens) > MAX_FULL_TEXT_TOKENS:
+        text = _get_encoding().decode(tokens[:MAX_FULL_TEXT_TOKENS])
     
-    prompt = f"""
-    You are an expert at extracting challenging MATHEMATICAL REASONING problems from academic papers.
-    
-    PAPER CONTEXT:
-    {context}
-    
-    Extract question-answer pairs from the following academic paper.
-    FOCUS EXCLUSIVELY on mathematical content that requires PROOF, DERIVATION, or COMPLEX REASONING.
-    
-    PRIORITIZE questions that require:
-    1. Proving mathematical theorems, lemmas, or properties
-    2. Deriving equations or formulas
-    3. Analyzing algorithm complexity with mathematical reasoning
-    4. Solving optimization problems step-by-step
-    5. Formal mathematical arguments and logical deductions
-    
-    DO NOT include questions that:
-    - Simply ask for facts or information from the paper
-    - Can be answered without mathematical reasoning
-    - Are about general concepts without requiring proof or derivation
-    
-    Format your response as a JSON array of objects with 'question' and 'answer' fields.
-    
-    IMPORTANT: The questions should be formulated in a GENERIC way that doesn't require access to the paper.
-    Instead of saying "Prove Theorem 3.2 from the paper", say "Given that [state the theorem], prove that..."
-    
-    Each question MUST:
-    - Require mathematical reasoning, proof, or derivation to solve
-    - Include all necessary context from the paper
-    - Be self-contained with all required information
-    - Capture complete chains of mathematical reasoning
-    
-    The answer should provide a detailed, step-by-step mathematical solution with proper notation.
-    
-    Try to extract 10-15 high-quality MATHEMATICAL REASONING question-answer pairs.
-    
-    PAPER TEXT:
-    {text}
-    
-    OUTPUT FORMAT:
-    [
-        {{
-            "question": "Given that a telescope network scheduling problem can be formulated as an integer linear program with variables x_ij representing whether observation i is scheduled at time j, prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once.",
-            "answer": "To prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once, we need to analyze what this constraint means mathematically... [detailed mathematical reasoning]"
-        }},
-        {{
-            "question": "Derive the time complexity of the dynamic programming algorithm for solving the telescope scheduling problem with n observations and m time slots, and prove its correctness.",
-            "answer": "To derive the time complexity, we analyze each step of the algorithm... [step-by-step mathematical derivation]"
-        }},
-        ...
-    ]
-    """
+    prompt = PROMPT_EXTRACT_FULL_TEXT_PREFIX + f"\nPAPER CONTEXT:\n{context}\nPAPER TEXT:\n{text}\n"
     
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
+            qa_list = await _cached_completion(
+                client,
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2,
-                max_tokens=4000
+                max_tokens=4000,
+                response_format=QAList,
+                refresh=attempt > 0
             )
-            
-            content = response.choices[0].message.content
-            
-            try:
-                start_idx = content.find('[')
-                end_idx = content.rfind(']') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = content[start_idx:end_idx]
-                    qa_pairs = json.loads(json_str)
-                    qa_pairs = [pair for pair in qa_pairs if "question" in pair and "answer" in pair]
-                    return qa_pairs
-                else:
-                    print("Error: Could not find JSON array in response")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                    else:
-                        return []
-            except json.JSONDecodeError:
-                print("Error: Failed to parse JSON from response")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                else:
-                    return []
-                
-        except Exception as e:
-            print(f"Error calling OpenAI API: {e}")
+            return [pair.model_dump() for pair in qa_list.items]
+        
+        except ValidationError as e:
+            print("Error: Failed to parse response")
             if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
             else:
-                return []
-    
-    return []
+                raise ExtractionError("Failed to parse the QA pairs response") from e
+        except Exception as e:
+            raise ExtractionError(f"Error calling OpenAI API: {e}") from e
 
-def extract_qa_pairs(text_chunk, metadata, chunk_index, total_chunks, client, model="gpt-4o-mini", max_retries=3, retry_delay=2):
+async def extract_qa_pairs(chunk_batch, metadata, total_chunks, client, model="gpt-4o-mini", max_retries=3, retry_delay=2):
     context = f"Title: {metadata.get('title', 'Unknown')}\n"
     context += f"Field: {metadata.get('field', 'Operations Research')}\n"
     
@@ -208,111 +613,128 @@ def extract_qa_pairs(text_chunk, metadata, chunk_index, total_chunks, client, mo
     if metadata.get('named_elements'):
         context += f"Named theorems/algorithms: {', '.join(metadata.get('named_elements', []))}\n"
     
-    chunk_position = "beginning" if chunk_index == 0 else "middle" if chunk_index < total_chunks - 1 else "end"
-    
-    prompt = f"""
-    You are an expert at extracting challenging MATHEMATICAL REASONING problems from academic papers.
-    
-    PAPER CONTEXT:
-    {context}
-    
-    You are analyzing chunk {chunk_index + 1} of {total_chunks} (the {chunk_position} of the paper).
-    
-    Extract question-answer pairs from the following text from this specific paper.
-    FOCUS EXCLUSIVELY on mathematical content that requires PROOF, DERIVATION, or COMPLEX REASONING.
-    
-    PRIORITIZE questions that require:
-    1. Proving mathematical theorems, lemmas, or properties
-    2. Deriving equations or formulas
-    3. Analyzing algorithm complexity with mathematical reasoning
-    4. Solving optimization problems step-by-step
-    5. Formal mathematical arguments and logical deductions
+    # Several chunks share one request, so the instructions and paper context are
+    # only sent once for all of them
+    chunk_sections = []
+    for chunk_index, text_chunk in chunk_batch:
+        chunk_position = "beginning" if chunk_index == 0 else "middle" if chunk_index < total_chunks - 1 else "end"
+        chunk_sections.append(f"CHUNK {chunk_index + 1} (the {chunk_position} of the paper):\n{text_chunk}")
     
-    DO NOT include questions that:
-    - Simply ask for facts or information from the paper
-    - Can be answered without mathematical reasoning
-    - Are about general concepts without requiring proof or derivation
+    chunk_numbers = ", ".join(str(chunk_index + 1) for chunk_index, _ in chunk_batch)
+    chunk_label = f"chunk {chunk_numbers}" if len(chunk_batch) == 1 else f"chunks {chunk_numbers}"
+    batch_text = "\n---\n".join(chunk_sections)
     
-    Format your response as a JSON array of objects with 'question' and 'answer' fields.
-    
-    IMPORTANT: The questions should be formulated in a GENERIC way that doesn't require access to the paper.
-    Instead of saying "Prove Theorem 3.2 from the paper", say "Given that [state the theorem], prove that..."
-    
-    Each question MUST:
-    - Require mathematical reasoning, proof, or derivation to solve
-    - Include all necessary context from the paper
-    - Be self-contained with all required information
-    
-    The answer should provide a detailed, step-by-step mathematical solution with proper notation.
-    
-    If this chunk contains part of a proof or algorithm that continues from a previous chunk or extends to the next chunk, create questions that focus on the complete parts visible in this chunk.
-    
-    Try to extract 3-5 high-quality MATHEMATICAL REASONING question-answer pairs if possible.
-    
-    TEXT:
-    {text_chunk}
-    
-    OUTPUT FORMAT:
-    [
-        {{
-            "question": "Given that a telescope network scheduling problem can be formulated as an integer linear program with variables x_ij representing whether observation i is scheduled at time j, prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once.",
-            "answer": "To prove that the constraint Σj x_ij ≤ 1 ensures no observation is scheduled more than once, we need to analyze what this constraint means mathematically... [detailed mathematical reasoning]"
-        }},
-        {{
-            "question": "Derive the time complexity of the dynamic programming algorithm for solving the telescope scheduling problem with n observations and m time slots, and prove its correctness.",
-            "answer": "To derive the time complexity, we analyze each step of the algorithm... [step-by-step mathematical derivation]"
-        }},
-        ...
-    ]
-    """
+    # The paper context precedes the chunk text, so it is also part of the cached
+    # prefix for the other requests of the same paper
+    prompt = PROMPT_EXTRACT_CHUNK_PREFIX + f"\nPAPER CONTEXT:\n{context}\nYou are analyzing {chunk_label} of {total_chunks}.\n\nTEXT:\n{batch_text}\n"
     
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
+            qa_list = await _cached_completion(
+                client,
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2,
-                max_tokens=2000
+                max_tokens=2000 * len(chunk_batch),
+                response_format=ChunkQAList,
+                refresh=attempt > 0
             )
             
-            content = response.choices[0].message.content
+            pairs_by_chunk = {chunk_index: [] for chunk_index, _ in chunk_batch}
+            for chunk in qa_list.chunks:
+                if chunk.chunk - 1 in pairs_by_chunk:
+                    for pair in chunk.items:
+                        pairs_by_chunk[chunk.chunk - 1].append({**pair.model_dump(), "chunk_index": chunk.chunk - 1})
             
-            try:
-                start_idx = content.find('[')
-                end_idx = content.rfind(']') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = content[start_idx:end_idx]
-                    qa_pairs = json.loads(json_str)
-                    qa_pairs = [pair for pair in qa_pairs if "question" in pair and "answer" in pair]
-                    
-                    for pair in qa_pairs:
-                        pair["chunk_index"] = chunk_index
-                    
-                    return qa_pairs
-                else:
-                    print(f"Error: Could not find JSON array in response for chunk {chunk_index+1}")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                    else:
-                        return []
-            except json.JSONDecodeError:
-                print(f"Error: Failed to parse JSON from response for chunk {chunk_index+1}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                else:
-                    return []
-                
-        except Exception as e:
-            print(f"Error calling OpenAI API for chunk {chunk_index+1}: {e}")
+            return [pair for qa_pairs in pairs_by_chunk.values() for pair in qa_pairs]
+        
+        except ValidationError as e:
+            print(f"Error: Failed to parse response for {chunk_label}")
             if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
             else:
-                return []
+                raise ExtractionError(f"Failed to parse the response for {chunk_label}") from e
+        except Exception as e:
+            raise ExtractionError(f"Error calling OpenAI API for {chunk_label}: {e}") from e
+
+# Unit-normalized embeddings of the given questions, keyed by question text.
+# Returns None if the embedding request fails, in which case nothing is filtered
+async def _embed_questions(client, questions, model=EMBEDDING_MODEL):
+    use_cache = cache.enabled()
+    embeddings = {}
+    missing = []
+    
+    for question in questions:
+        cached = cache.get(cache.make_embedding_key(model, question)) if use_cache else None
+        if cached is not None:
+            embeddings[question] = np.array(orjson.loads(cached), dtype=np.float32)
+        else:
+            missing.append(question)
+    
+    if missing:
+        try:
+            response = await _call_with_backoff(client.create_embeddings, model=model, input=missing)
+        except Exception as e:
+            print(f"Error computing question embeddings: {e}")
+            return None
+        
+        for question, item in zip(missing, response.data):
+            embeddings[question] = np.array(item.embedding, dtype=np.float32)
+            if use_cache:
+                cache.set(cache.make_embedding_key(model, question), orjson.dumps(item.embedding).decode(), model)
+    
+    for question, vector in embeddings.items():
+        embeddings[question] = vector / (np.linalg.norm(vector) or 1.0)
     
-    return []
+    return embeddings
 
-def analyze_cross_chunk_content(all_qa_pairs, full_text, client, model="gpt-4o-mini"):
+# Asks for one QA pair covering two related pairs from nearby chunks
+async def merge_cross_chunk_pairs(first, second, chunks, client, model="gpt-4o-mini"):
+    # Content spanning the two chunks is around where one ends and the next
+    # begins, so the end of the first and the start of the second are kept
+    relevant_text = (
+        truncate_tokens(chunks[first["chunk_index"]], CROSS_CHUNK_CONTEXT_TOKENS, from_end=True)
+        + "\n"
+        + truncate_tokens(chunks[second["chunk_index"]], CROSS_CHUNK_CONTEXT_TOKENS)
+    )
+    
+    prompt = f"""
+    I have identified related mathematical content that spans multiple sections of the paper.
+    
+    CONTENT FROM SECTION {first["chunk_index"] + 1}-{second["chunk_index"] + 1}:
+    {relevant_text}
+    
+    RELATED QUESTIONS IDENTIFIED:
+    1. {first["question"]}
+    2. {second["question"]}
+    
+    Please create ONE comprehensive question-answer pair that covers this mathematical content completely.
+    The question MUST require mathematical reasoning, proof, or derivation to solve.
+    The answer should provide a complete, step-by-step mathematical solution with proper notation.
+    The final_answer should state only the final result or conclusion of that solution in one or two sentences.
+    
+    IMPORTANT: The question should be formulated in a GENERIC way that doesn't require access to the paper.
+    Include enough context from the paper so it can be understood without access to the paper.
+    """
+    
+    try:
+        enhanced_pair = await _cached_completion(
+            client,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=2000,
+            response_format=QAPair
+        )
+        
+        return enhanced_pair.model_dump()
+    
+    except ValidationError as e:
+        raise ExtractionError(f"Failed to parse cross-chunk response: {e}") from e
+    except Exception as e:
+        raise ExtractionError(f"Error calling OpenAI API for cross-chunk analysis: {e}") from e
+
+async def analyze_cross_chunk_content(all_qa_pairs, chunks, client, model="gpt-4o-mini"):
     if not all_qa_pairs:
         return []
     
@@ -325,85 +747,44 @@ def analyze_cross_chunk_content(all_qa_pairs, full_text, client, model="gpt-4o-m
                     grouped_pairs[term] = []
                 grouped_pairs[term].append(pair)
     
-    enhanced_pairs = []
-    processed_indices = set()
+    candidate_questions = set()
+    for pairs in grouped_pairs.values():
+        pairs.sort(key=lambda x: x["chunk_index"])
+        for i in range(len(pairs) - 1):
+            if pairs[i]["chunk_index"] + 1 == pairs[i+1]["chunk_index"] or pairs[i]["chunk_index"] + 2 == pairs[i+1]["chunk_index"]:
+                candidate_questions.update((pairs[i]["question"], pairs[i+1]["question"]))
+    
+    # Questions that only share a keyword are usually unrelated, so a merge request
+    # is only made when their embeddings are similar enough
+    embeddings = await _embed_questions(client, sorted(candidate_questions)) if candidate_questions else None
+    
+    # Each chunk takes part in at most one merge. The merges are chosen up front and
+    # requested together: the ThrottledClient bounds their concurrency, and with a
+    # BatchClient they go out in a single batch instead of one batch each
+    merges = []
+    claimed_indices = set()
     
     for term, pairs in grouped_pairs.items():
         if len(pairs) <= 1:
             continue
         
-        pairs.sort(key=lambda x: x["chunk_index"])
-        
         for i in range(len(pairs) - 1):
             if pairs[i]["chunk_index"] + 1 == pairs[i+1]["chunk_index"] or pairs[i]["chunk_index"] + 2 == pairs[i+1]["chunk_index"]:
-                if pairs[i]["chunk_index"] in processed_indices or pairs[i+1]["chunk_index"] in processed_indices:
+                if pairs[i]["chunk_index"] in claimed_indices or pairs[i+1]["chunk_index"] in claimed_indices:
                     continue
                 
-                start_pos = max(0, pairs[i]["chunk_index"] * 7500)
-                end_pos = min(len(full_text), (pairs[i+1]["chunk_index"] + 1) * 7500)
-                relevant_text = full_text[start_pos:end_pos]
-                
-                prompt = f"""
-                I have identified related mathematical content that spans multiple sections of the paper.
-                
-                CONTENT FROM SECTION {pairs[i]["chunk_index"] + 1}-{pairs[i+1]["chunk_index"] + 1}:
-                {relevant_text[:8000]}
-                
-                RELATED QUESTIONS IDENTIFIED:
-                1. {pairs[i]["question"]}
-                2. {pairs[i+1]["question"]}
+                if embeddings is not None:
+                    similarity = float(np.dot(embeddings[pairs[i]["question"]], embeddings[pairs[i+1]["question"]]))
+                    if similarity < CROSS_CHUNK_SIMILARITY_THRESHOLD:
+                        continue
                 
-                Please create ONE comprehensive question-answer pair that covers this mathematical content completely.
-                The question MUST require mathematical reasoning, proof, or derivation to solve.
-                The answer should provide a complete, step-by-step mathematical solution with proper notation.
-                
-                IMPORTANT: The question should be formulated in a GENERIC way that doesn't require access to the paper.
-                Include enough context from the paper so it can be understood without access to the paper.
-                
-                OUTPUT FORMAT (return ONLY this JSON object, nothing else):
-                {{
-                    "question": "Comprehensive mathematical reasoning question covering the full mathematical content",
-                    "answer": "Complete, detailed mathematical solution with all necessary steps and reasoning"
-                }}
-                """
-                
-                try:
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.2,
-                        max_tokens=2000
-                    )
-                    
-                    content = response.choices[0].message.content.strip()
-                    
-                    try:
-                        if content.startswith('```json'):
-                            content = content[7:]
-                        if content.endswith('```'):
-                            content = content[:-3]
-                        
-                        content = content.strip()
-                        
-                        start_idx = content.find('{')
-                        end_idx = content.rfind('}') + 1
-                        
-                        if start_idx >= 0 and end_idx > start_idx:
-                            json_str = content[start_idx:end_idx]
-                            enhanced_pair = json.loads(json_str)
-                            if "question" in enhanced_pair and "answer" in enhanced_pair:
-                                enhanced_pairs.append(enhanced_pair)
-                                processed_indices.add(pairs[i]["chunk_index"])
-                                processed_indices.add(pairs[i+1]["chunk_index"])
-                            else:
-                                print("Error: Enhanced pair missing question or answer fields")
-                        else:
-                            print("Error: Could not find JSON object in cross-chunk response")
-                    except json.JSONDecodeError as e:
-                        print(f"Error: Failed to parse JSON from cross-chunk response: {e}")
-                        
-                except Exception as e:
-                    print(f"Error calling OpenAI API for cross-chunk analysis: {e}")
+                claimed_indices.update((pairs[i]["chunk_index"], pairs[i+1]["chunk_index"]))
+                merges.append((pairs[i], pairs[i+1]))
+    
+    merged = await asyncio.gather(*[merge_cross_chunk_pairs(first, second, chunks, client, model) for first, second in merges])
+    
+    enhanced_pairs = list(merged)
+    processed_indices = claimed_indices
     
     for pair in all_qa_pairs:
         if pair["chunk_index"] not in processed_indices:
@@ -414,16 +795,34 @@ def analyze_cross_chunk_content(all_qa_pairs, full_text, client, model="gpt-4o-m
         
     return enhanced_pairs
 
-def deduplicate_qa_pairs(qa_pairs):
+def _question_minhash(question, num_perm=64, shingle_size=5):
+    minhash = MinHash(num_perm=num_perm)
+    for i in range(max(len(question) - shingle_size + 1, 1)):
+        minhash.update(question[i:i + shingle_size].encode("utf8"))
+    return minhash
+
+def deduplicate_qa_pairs(qa_pairs, threshold=0.85):
+    # Near-duplicates (Jaccard similarity of character 5-shingles >= threshold) are
+    # dropped when datasketch is installed; otherwise only exact duplicates after
+    # normalization are
+    lsh = MinHashLSH(threshold=threshold, num_perm=64) if MinHashLSH is not None else None
     seen_questions = set()
     unique_pairs = []
     
     for pair in qa_pairs:
-        question = re.sub(r'[^\w\s]', '', pair["question"].strip().lower())
-        question = re.sub(r'\s+', ' ', question)
-        if question not in seen_questions:
-            seen_questions.add(question)
-            unique_pairs.append(pair)
+        question = _PUNCT_RE.sub('', pair["question"].strip().lower())
+        question = _WS_RE.sub(' ', question)
+        if question in seen_questions:
+            continue
+        
+        if lsh is not None:
+            minhash = _question_minhash(question)
+            if lsh.query(minhash):
+                continue
+            lsh.insert(str(len(unique_pairs)), minhash)
+        
+        seen_questions.add(question)
+        unique_pairs.append(pair)
     
     return unique_pairs
 
@@ -437,6 +836,7 @@ def format_qa_pairs_for_output(qa_pairs, max_pairs=50):
         formatted_pair = {
             'question': question,
             'answer': pair['answer'],
+            'final_answer': pair.get('final_answer', ''),
             'prompt': [
                 {
                     'content': '\nRespond in the following format:\n<reasoning>\n...\n</reasoning>\n<answer>\n...\n</answer>\n',
@@ -452,92 +852,224 @@ def format_qa_pairs_for_output(qa_pairs, max_pairs=50):
     
     return formatted_pairs
 
-def process_pdf(pdf_path, output_dir="reasoning_traces", output_index=1, api_key=None, model="gpt-4o", max_pairs=50, force_chunking=False):
+# The key covers everything the pairs depend on: the PDF bytes, the model, the
+# output settings, the output schema and TRACE_CACHE_VERSION for the prompts
+def _trace_cache_path(trace_cache_dir, pdf_path, model, max_pairs, force_chunking):
+    with open(pdf_path, 'rb') as f:
+        digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16))
+    digest.update(f"|{model}|{max_pairs}|{force_chunking}|{TRACE_CACHE_VERSION}|".encode())
+    digest.update(orjson.dumps(QAPair.model_json_schema(), option=orjson.OPT_SORT_KEYS))
+    return os.path.join(trace_cache_dir, f"{digest.hexdigest()}.json")
+
+def _write_output(output_dir, output_index, content):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    output_path = os.path.join(output_dir, f"output{output_index}.json")
+    with open(output_path, 'wb') as f:
+        f.write(content)
+    return output_path
+
+def process_pdf(pdf_path, output_dir="reasoning_traces", output_index=1, api_key=None, model="gpt-4o", max_pairs=50, force_chunking=False, max_concurrent=MAX_CONCURRENT_REQUESTS, page_workers=1, trace_cache_dir=TRACE_CACHE_DIR, processes=1):
+    return asyncio.run(process_pdf_async(pdf_path, output_dir, output_index, api_key, model, max_pairs, force_chunking, max_concurrent, page_workers, trace_cache_dir=trace_cache_dir, processes=processes))
+
+async def process_pdf_async(pdf_path, output_dir="reasoning_traces", output_index=1, api_key=None, model="gpt-4o", max_pairs=50, force_chunking=False, max_concurrent=MAX_CONCURRENT_REQUESTS, page_workers=1, client=None, trace_cache_dir=TRACE_CACHE_DIR, processes=1):
+    # Checked before anything else, so a cached PDF needs neither text extraction
+    # nor an API key
+    cache_path = None
+    if trace_cache_dir and cache.enabled():
+        cache_path = _trace_cache_path(trace_cache_dir, pdf_path, model, max_pairs, force_chunking)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                output_path = _write_output(output_dir, output_index, f.read())
+            print(f"Using cached QA pairs for PDF {output_index}: {os.path.basename(pdf_path)}")
+            return output_path
+    
     if not api_key:
         api_key = os.environ.get("OPENAI_API_KEY")
     
     if not api_key:
         raise ValueError("Error: OpenAI API key not provided. Please set OPENAI_API_KEY environment variable or use the --api_key argument.")
     
-    client = OpenAI(api_key=api_key)
+    # A BatchClient can be passed in to send the requests through the Batch API.
+    # `processes` is the number of PDFs processed in parallel, which share the rate limits
+    if client is None:
+        client = ThrottledClient(AsyncOpenAI(api_key=api_key), max_concurrent, processes=processes)
     
     print(f"Processing PDF {output_index}: {os.path.basename(pdf_path)}")
     
-    text = extract_text_from_pdf(pdf_path)
-    metadata = extract_paper_metadata(text, client, model)
+    text = extract_text_from_pdf(pdf_path, page_workers)
+    if not text.strip():
+        raise ValueError(f"No text could be extracted from {pdf_path}")
     
-    use_chunking = force_chunking or len(text) > 60000
+    metadata = await extract_paper_metadata(text, client, model)
+    
+    use_chunking = force_chunking or count_tokens(text) > MAX_FULL_TEXT_TOKENS
     
     if use_chunking:
-        chunks = chunk_text(text, max_chunk_size=8000, overlap=500)
+        chunks = chunk_text(text)
         print(f"Processing {len(chunks)} chunks...")
         
-        all_qa_pairs = []
-        for i, chunk in enumerate(tqdm(chunks, desc="Processing", leave=False)):
-            qa_pairs = extract_qa_pairs(chunk, metadata, i, len(chunks), client, model=model)
-            all_qa_pairs.extend(qa_pairs)
-            
-            if i < len(chunks) - 1:
-                time.sleep(1)
+        indexed_chunks = list(enumerate(chunks))
+        chunk_batches = [indexed_chunks[i:i + CHUNKS_PER_REQUEST] for i in range(0, len(indexed_chunks), CHUNKS_PER_REQUEST)]
         
-        enhanced_qa_pairs = analyze_cross_chunk_content(all_qa_pairs, text, client, model)
+        # Concurrency is bounded by the client's AIMD limit and rate limits; results
+        # come back in chunk order, so the pairs are ordered as before
+        chunk_results = await tqdm.gather(*[extract_qa_pairs(chunk_batch, metadata, len(chunks), client, model=model) for chunk_batch in chunk_batches], desc="Processing", leave=False)
+        all_qa_pairs = [pair for qa_pairs in chunk_results for pair in qa_pairs]
+        
+        enhanced_qa_pairs = await analyze_cross_chunk_content(all_qa_pairs, chunks, client, model)
     else:
-        all_qa_pairs = extract_qa_pairs_from_full_text(text, metadata, client, model=model)
+        all_qa_pairs = await extract_qa_pairs_from_full_text(text, metadata, client, model=model)
         enhanced_qa_pairs = all_qa_pairs
     
     unique_qa_pairs = deduplicate_qa_pairs(enhanced_qa_pairs)
     formatted_pairs = format_qa_pairs_for_output(unique_qa_pairs, max_pairs)
     
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    # Failed requests raise ExtractionError above, and an empty result is not kept
+    # either, so that neither is cached or recorded in the manifest and the PDF is
+    # tried again on the next run
+    if not formatted_pairs:
+        raise ExtractionError(f"No QA pairs could be extracted from {pdf_path}")
     
-    output_path = os.path.join(output_dir, f"output{output_index}.json")
-    with open(output_path, 'w') as f:
-        json.dump(formatted_pairs, f, indent=2)
+    content = orjson.dumps(formatted_pairs, option=orjson.OPT_INDENT_2)
+    output_path = _write_output(output_dir, output_index, content)
+    
+    if cache_path:
+        # Written under a temporary name first, so that concurrent workers never
+        # read a partial entry
+        os.makedirs(trace_cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
     
     print(f"Extracted {len(formatted_pairs)} QA pairs from PDF {output_index}")
     return output_path
 
-def process_pdfs_directory(api_key=None, max_pairs=50, num_pdfs=None, force_chunking=False, eval_dir=None):
+# Hidden so that format_data.py's *.json glob doesn't pick it up as a QA file
+MANIFEST_FILE = ".manifest.json"
+
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def _output_indices(output_dir):
+    indices = []
+    for f in os.listdir(output_dir):
+        match = re.fullmatch(r"output(\d+)\.json", f)
+        if match:
+            indices.append(int(match.group(1)))
+    return indices
+
+def load_manifest(output_dir, pdf_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            return orjson.loads(f.read())
+    
+    # Output directories from before the manifest existed: earlier runs processed
+    # the PDFs in directory listing order, so outputN.json belongs to the Nth PDF
+    existing_outputs = len(_output_indices(output_dir))
+    legacy_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')][:existing_outputs]
+    manifest = {_file_sha256(os.path.join(pdf_dir, f)): i + 1 for i, f in enumerate(legacy_files)}
+    
+    if manifest:
+        print(f"Recorded {len(manifest)} previously processed PDFs in {manifest_path}")
+        save_manifest(output_dir, manifest)
+    
+    return manifest
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, manifest_path)
+
+# Runs every PDF's pipeline in one event loop with a shared BatchCollector, so the
+# requests of all PDFs are sent together as Batch API jobs
+async def _process_pdfs_batch(jobs, output_dir, api_key, model, max_pairs, force_chunking, page_workers, trace_cache_dir):
+    collector = BatchCollector(AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY")), os.path.join(output_dir, ".batches"))
+    return await asyncio.gather(*[
+        process_pdf_async(pdf_path, output_dir, output_index, api_key, model, max_pairs, force_chunking, page_workers=page_workers, client=BatchClient(collector, f"pdf{output_index}"), trace_cache_dir=trace_cache_dir)
+        for pdf_path, output_index in jobs
+    ], return_exceptions=True)
+
+def process_pdfs_directory(api_key=None, max_pairs=50, num_pdfs=None, force_chunking=False, eval_dir=None, workers=None, max_concurrent=MAX_CONCURRENT_REQUESTS, model="gpt-4o", pdf_dir=None, output_dir=None, batch=False, trace_cache_dir=TRACE_CACHE_DIR):
+    # pdf_dir and output_dir override the default directories, e.g. when called from main.py
     if eval_dir:
-        pdf_dir = os.path.join("evals", "pdfs")
-        output_dir = os.path.join("evals", "eval_dataset")
+        pdf_dir = pdf_dir or os.path.join("evals", "pdfs")
+        output_dir = output_dir or os.path.join("evals", "eval_dataset")
     else:
-        pdf_dir = "pdfs"
-        output_dir = "reasoning_traces"
+        pdf_dir = pdf_dir or "pdfs"
+        output_dir = output_dir or "reasoning_traces"
     
     if not os.path.exists(pdf_dir):
         raise ValueError(f"Error: PDF directory does not exist: {pdf_dir}")
     
-    existing_outputs = 0
-    if os.path.exists(output_dir):
-        existing_outputs = len([f for f in os.listdir(output_dir) if f.startswith("output") and f.endswith(".json")])
-    
-    pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
+    pdf_files = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf'))
     
     if num_pdfs and num_pdfs < len(pdf_files):
         pdf_files = pdf_files[:num_pdfs]
     
-    if existing_outputs > 0:
-        print(f"Found {existing_outputs} existing output files. Skipping the first {existing_outputs} PDFs.")
-        if existing_outputs >= len(pdf_files):
-            print("All PDFs have already been processed. Nothing to do.")
-            return
-        pdf_files = pdf_files[existing_outputs:]
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    manifest = load_manifest(output_dir, pdf_dir)
+    pdf_hashes = {pdf_file: _file_sha256(os.path.join(pdf_dir, pdf_file)) for pdf_file in pdf_files}
+    
+    already_processed = [f for f in pdf_files if pdf_hashes[f] in manifest]
+    if already_processed:
+        print(f"Found {len(already_processed)} PDFs that have already been processed. Skipping them.")
+    pdf_files = [f for f in pdf_files if pdf_hashes[f] not in manifest]
+    
+    if not pdf_files:
+        print("All PDFs have already been processed. Nothing to do.")
+        return
     
     print(f"Processing {len(pdf_files)} PDF files from {pdf_dir}")
     
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    next_index = max([*manifest.values(), *_output_indices(output_dir)], default=0) + 1
+    jobs = [(os.path.join(pdf_dir, pdf_file), next_index + i) for i, pdf_file in enumerate(pdf_files)]
     
-    for i, pdf_file in enumerate(pdf_files):
-        output_index = i + 1 + existing_outputs
-        pdf_path = os.path.join(pdf_dir, pdf_file)
+    if batch:
+        # The PDFs are extracted one after another in this process, each using all
+        # CPUs for its pages, while their requests wait to be batched together
+        results = asyncio.run(_process_pdfs_batch(jobs, output_dir, api_key, model, max_pairs, force_chunking, os.cpu_count() or 1, trace_cache_dir))
         
-        try:
-            process_pdf(pdf_path, output_dir, output_index, api_key, "gpt-4o", max_pairs, force_chunking)
-        except Exception as e:
-            print(f"Error processing {pdf_file}: {e}")
+        for (pdf_path, output_index), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                print(f"Error processing {os.path.basename(pdf_path)}: {result}")
+                continue
+            manifest[pdf_hashes[os.path.basename(pdf_path)]] = output_index
+        
+        save_manifest(output_dir, manifest)
+    else:
+        # Text extraction is CPU-bound, so PDFs are processed in separate processes
+        # rather than threads
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        
+        # Share the remaining CPUs between the PDFs for page-level extraction
+        page_workers = max(1, (os.cpu_count() or 1) // workers)
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(process_pdf, pdf_path, output_dir, output_index, api_key, model, max_pairs, force_chunking, max_concurrent, page_workers, trace_cache_dir, workers): (pdf_path, output_index)
+                for pdf_path, output_index in jobs
+            }
+            
+            for future in tqdm(as_completed(futures), total=len(futures), desc="PDFs"):
+                pdf_path, output_index = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error processing {os.path.basename(pdf_path)}: {e}")
+                    continue
+                
+                # Recorded only once the output is written, so a failed PDF is retried next run
+                manifest[pdf_hashes[os.path.basename(pdf_path)]] = output_index
+                save_manifest(output_dir, manifest)
     
     print(f"Processing complete. Processed {len(pdf_files)} PDF files.")
     
@@ -553,6 +1085,15 @@ if __name__ == "__main__":
     parser.add_argument("--num_pdfs", type=int, help="Number of PDFs to process (default: all)")
     parser.add_argument("--force_chunking", action="store_true", help="Force using chunking even for small PDFs")
     parser.add_argument("--eval", help="Process PDFs from the specified evaluation directory instead of the default pdfs directory")
+    parser.add_argument("--workers", type=int, help="Number of PDFs to process in parallel (default: number of CPUs)")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore and don't update the OpenAI response and trace caches")
+    parser.add_argument("--trace_cache_dir", default=TRACE_CACHE_DIR, help="Directory of cached QA pairs per PDF, shared between runs and output directories (default: $TRACE_CACHE_DIR or cache/traces)")
+    parser.add_argument("--batch", action="store_true", help="Send the extraction requests of all PDFs through the OpenAI Batch API at half cost; results may take up to 24 hours")
+    parser.add_argument("--max_concurrent", type=int, default=MAX_CONCURRENT_REQUESTS, help="Initial concurrent OpenAI requests per PDF, adjusted to observed latency and rate limits (default: $EXTRACT_MAX_CONCURRENT_REQUESTS or 5)")
     args = parser.parse_args()
     
-    process_pdfs_directory(args.api_key, args.max_pairs, args.num_pdfs, args.force_chunking, args.eval)
+    if args.no_cache:
+        # Set in the environment so that the worker processes inherit it
+        os.environ["LLM_CACHE_ENABLED"] = "0"
+    
+    process_pdfs_directory(args.api_key, args.max_pairs, args.num_pdfs, args.force_chunking, args.eval, args.workers, args.max_concurrent, batch=args.batch, trace_cache_dir=args.trace_cache_dir)
@@ -1,12 +1,78 @@
 import os
-import json
+import orjson
 import glob
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# v2: <answer> holds only the final answer instead of repeating the full solution
+FORMAT_VERSION = "v2"
+
+def _load_json_file(json_file):
+    with open(json_file, 'rb') as f:
+        return orjson.loads(f.read())
+
+def load_json_files(json_files, max_workers=16):
+    """
+    Read JSON files on a thread pool, yielding them in their original order.
+    
+    At most 2 * max_workers files are read ahead of the consumer, so memory use
+    stays bounded however many files there are.
+    
+    Args:
+        json_files (list): Paths of the JSON files to read
+        max_workers (int): Number of reader threads
+        
+    Yields:
+        tuple: (json_file, data), with data None if the file could not be read
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        files = iter(json_files)
+        
+        for json_file in files:
+            pending.append((json_file, executor.submit(_load_json_file, json_file)))
+            if len(pending) >= 2 * max_workers:
+                break
+        
+        while pending:
+            json_file, future = pending.popleft()
+            
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(_load_json_file, next_file)))
+            
+            try:
+                yield json_file, future.result()
+            except Exception as e:
+                print(f"Error processing {json_file}: {e}")
+                yield json_file, None
+
+def _final_answer(pair):
+    """
+    Short final answer for the <answer> tag of an assistant message.
+    
+    Pairs extracted before final_answer was added fall back to the last
+    non-empty line of the full answer.
+    
+    Args:
+        pair (dict): QA pair as written by extract_traces.py
+        
+    Returns:
+        str: The final answer
+    """
+    final_answer = pair.get('final_answer', '').strip()
+    if final_answer:
+        return final_answer
+    
+    lines = [line for line in pair.get('answer', '').splitlines() if line.strip()]
+    return lines[-1].strip() if lines else ''
 
 def combine_qa_files(input_dir="reasoning_traces", output_file="combined_dataset.jsonl"):
     """
     Combine all JSON files in the input directory into a single JSONL file for training.
-    Formats the data for fine-tuning with OpenAI API.
+    Formats the data for fine-tuning with OpenAI API, and records FORMAT_VERSION
+    in a <output_file>.meta.json file next to it.
     
     Args:
         input_dir (str): Directory containing the JSON files with Q/A pairs
@@ -23,41 +89,37 @@ def combine_qa_files(input_dir="reasoning_traces", output_file="combined_dataset
     
     print(f"Found {len(json_files)} JSON files to combine")
     
-    all_qa_pairs = []
-    
-    for json_file in json_files:
-        try:
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-                print(f"Loaded {len(data)} QA pairs from {json_file}")
-                all_qa_pairs.extend(data)
-        except Exception as e:
-            print(f"Error processing {json_file}: {e}")
-    
-    print(f"Total QA pairs collected: {len(all_qa_pairs)}")
-    
-    formatted_data = []
-    for pair in all_qa_pairs:
-        messages = pair.get('prompt', [])
-        
-        if not messages:
-            messages = [
-                {"role": "system", "content": "You are a mathematical reasoning assistant that provides detailed step-by-step solutions."},
-                {"role": "user", "content": pair.get('question', '')}
-            ]
-        
-        messages.append({
-            "role": "assistant", 
-            "content": f"<reasoning>\n{pair.get('answer', '')}\n</reasoning>\n<answer>\n{pair.get('answer', '')}\n</answer>"
-        })
-        
-        formatted_data.append({"messages": messages})
-    
-    with open(output_file, 'w') as f:
-        for item in formatted_data:
-            f.write(json.dumps(item) + '\n')
-    
-    print(f"Successfully wrote {len(formatted_data)} examples to {output_file}")
+    # Pairs are formatted and written one file at a time, so only a single input
+    # file is held in memory
+    total_pairs = 0
+    
+    with open(output_file, 'wb', buffering=1 << 20) as out:
+        for json_file, data in load_json_files(json_files):
+            if data is None:
+                continue
+            print(f"Loaded {len(data)} QA pairs from {json_file}")
+            
+            for pair in data:
+                messages = pair.get('prompt', [])
+                
+                if not messages:
+                    messages = [
+                        {"role": "system", "content": "You are a mathematical reasoning assistant that provides detailed step-by-step solutions."},
+                        {"role": "user", "content": pair.get('question', '')}
+                    ]
+                
+                messages.append({
+                    "role": "assistant", 
+                    "content": f"<reasoning>\n{pair.get('answer', '')}\n</reasoning>\n<answer>\n{_final_answer(pair)}\n</answer>"
+                })
+                
+                out.write(orjson.dumps({"messages": messages}, option=orjson.OPT_APPEND_NEWLINE))
+                total_pairs += 1
+    
+    with open(f"{output_file}.meta.json", 'wb') as f:
+        f.write(orjson.dumps({"format_version": FORMAT_VERSION, "examples": total_pairs}))
+    
+    print(f"Successfully wrote {total_pairs} examples to {output_file} (format {FORMAT_VERSION})")
     return output_file
 
 def combine_eval_files(input_dir="evals/eval_dataset", output_file="eval_dataset.json"):
@@ -82,19 +144,21 @@ def combine_eval_files(input_dir="evals/eval_dataset", output_file="eval_dataset
     
     all_qa_pairs = []
     
-    for json_file in json_files:
-        try:
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-                print(f"Loaded {len(data)} QA pairs from {json_file}")
-                all_qa_pairs.extend(data)
-        except Exception as e:
-            print(f"Error processing {json_file}: {e}")
+    for json_file, data in load_json_files(json_files):
+        if data is None:
+            continue
+        print(f"Loaded {len(data)} QA pairs from {json_file}")
+        all_qa_pairs.extend(data)
     
     print(f"Total evaluation QA pairs collected: {len(all_qa_pairs)}")
     
-    with open(output_file, 'w') as f:
-        json.dump(all_qa_pairs, f, indent=2)
+    with open(output_file, 'wb', buffering=1 << 20) as f:
+        if output_file.endswith(".jsonl"):
+            # One example per line, so eval.py can stream the dataset
+            for pair in all_qa_pairs:
+                f.write(orjson.dumps(pair, option=orjson.OPT_APPEND_NEWLINE))
+        else:
+            f.write(orjson.dumps(all_qa_pairs, option=orjson.OPT_INDENT_2))
     
     print(f"Successfully wrote {len(all_qa_pairs)} examples to {output_file}")
     return output_file
@@ -1,23 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
-import subprocess
 import os
 from pathlib import Path
 
-def run_command(cmd):
-    """Run a shell command and print its output."""
-    print(f"Running: {' '.join(cmd)}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error running command: {' '.join(cmd)}")
-        print(f"Error output: {result.stderr}")
-        raise Exception(f"Command failed with return code {result.returncode}")
-    print(result.stdout)
-    return result
+# Each stage is imported and called in-process rather than run as a separate
+# `python <script>.py`, so the interpreter and its imports are only loaded once.
+# The imports are local to each pipeline so a mode only loads what it uses.
+
+# Both pipelines use extract_traces' default trace cache directory
+# (TRACE_CACHE_DIR, overridable through $TRACE_CACHE_DIR), so a PDF that either of
+# them has processed before is never sent to the model again.
 
 def scrape_data(args):
     """Handle the data scraping and processing pipeline."""
+    from scraper import main as scrape_main
+    from extract_traces import process_pdfs_directory
+    from format_data import combine_qa_files
+
     base_dir = Path(args.output_dir)
     pdf_dir = base_dir / "pdfs"
     traces_dir = base_dir / "reasoning_traces"
@@ -26,24 +26,13 @@ def scrape_data(args):
     for dir_path in [pdf_dir, traces_dir]:
         dir_path.mkdir(parents=True, exist_ok=True)
 
-    run_command([
-        "python", "scraper.py",
-        "--output_dir", str(pdf_dir),
-        "--query", args.query
-    ])
-
-    run_command([
-        "python", "extract_traces.py",
-        "--input_dir", str(pdf_dir),
-        "--output_dir", str(traces_dir),
-        "--model", args.model
-    ])
-
-    run_command([
-        "python", "format_data.py",
-        "--input_dir", str(traces_dir),
-        "--output_file", str(output_file)
-    ])
+    scrape_main([args.query], output_dir=str(pdf_dir))
+
+    # The PDFs are sharded across a process pool of args.workers processes; only
+    # paths and the model name are sent to the workers
+    process_pdfs_directory(workers=args.workers, model=args.extraction_model, pdf_dir=str(pdf_dir), output_dir=str(traces_dir))
+
+    combine_qa_files(str(traces_dir), str(output_file))
 
     print(f"\nScraping pipeline completed successfully!")
     print(f"PDFs saved to: {pdf_dir}")
@@ -52,6 +41,11 @@ def scrape_data(args):
 
 def train_and_eval(args):
     """Handle the training and evaluation pipeline."""
+    from sft import run_fine_tuning
+    from extract_traces import process_pdfs_directory
+    from format_data import combine_eval_files
+    from eval import run_evaluation
+
     base_dir = Path(args.output_dir)
     models_dir = Path("models")
     evals_dir = base_dir / "evals"
@@ -62,33 +56,13 @@ def train_and_eval(args):
     evals_dir.mkdir(exist_ok=True)
     eval_results_dir.mkdir(exist_ok=True)
 
-    run_command([
-        "python", "sft.py",
-        "--training_file", str(base_dir / "sft_data.jsonl"),
-        "--model", args.model,
-        "--output_dir", str(models_dir)
-    ])
-
-    run_command([
-        "python", "extract_traces.py",
-        "--input_dir", str(base_dir / "pdfs"),
-        "--output_dir", str(evals_dir),
-        "--model", str(models_dir / args.fine_tuned_model),
-        "--eval_mode"
-    ])
-
-    run_command([
-        "python", "format_data.py",
-        "--input_dir", str(evals_dir),
-        "--output_file", str(eval_data_file),
-        "--eval_mode"
-    ])
-
-    run_command([
-        "python", "eval.py",
-        "--input_file", str(eval_data_file),
-        "--output_dir", str(eval_results_dir)
-    ])
+    run_fine_tuning(input_file=str(base_dir / "sft_data.jsonl"), model=args.model)
+
+    process_pdfs_directory(workers=args.workers, model=args.extraction_model, pdf_dir=str(base_dir / "pdfs"), output_dir=str(evals_dir), eval_dir=str(evals_dir))
+
+    combine_eval_files(str(evals_dir), str(eval_data_file))
+
+    run_evaluation(str(eval_data_file), model_a=args.fine_tuned_model, output_file=str(eval_results_dir / "eval_results.json"))
 
     print(f"\nTraining and evaluation pipeline completed successfully!")
     print(f"Model saved to: {models_dir}")
@@ -101,6 +75,8 @@ def main():
     common_parser = argparse.ArgumentParser(add_help=False)
     common_parser.add_argument("--output_dir", default="data", help="Base directory for all outputs")
     common_parser.add_argument("--model", default="gpt-4", help="Model to use")
+    common_parser.add_argument("--extraction_model", default="gpt-4o", help="Model that extracts the QA pairs from the PDFs; needs structured outputs (default: gpt-4o)")
+    common_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of PDFs to extract in parallel processes (default: number of CPUs)")
 
     scrape_parser = subparsers.add_parser("scrape", parents=[common_parser], help="Run data scraping pipeline")
     scrape_parser.add_argument("--query", required=True, help="Search query for arXiv papers")
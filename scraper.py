@@ -1,19 +1,98 @@
 import requests
-import feedparser
+import asyncio
+import httpx
 import os
+import hashlib
+import importlib.util
+import orjson
 import time
 import urllib.parse
-import random
 import argparse
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
+import cache
 
-def download_arxiv_papers(search_query="operations research", max_articles=None, start=0, max_results=100):
-    base_url = "http://export.arxiv.org/api/query?"
+# HTTP/2 needs the h2 package; without it the downloads use HTTP/1.1
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+DOWNLOAD_CONCURRENCY = 8
+MAX_CONNECTIONS_PER_HOST = 4
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+USER_AGENT = "arxiv-sft-scrape/1.0"
+REQUESTS_PER_SECOND = 3
+MAX_DOWNLOAD_RETRIES = 3
+ARXIV_CACHE_TTL = 3600
+ATOM_NS = {'atom': 'http://www.w3.org/2005/Atom'}
+
+# Characters not allowed in filenames become underscores, line breaks and tabs spaces
+_SAFE_FILENAME_TABLE = str.maketrans({**{c: '_' for c in '/\\:*?"<>|'}, '\n': ' ', '\r': ' ', '\t': ' '})
+
+# Shared session for the arXiv API, so repeated queries reuse the kept-alive
+# connection and transient failures are retried with backoff
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+SESSION.headers.update({"User-Agent": USER_AGENT})
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` requests per second on average, in bursts of up to `rate`.
+    
+    Unlike a fixed delay after each request, a request only waits when the bucket is
+    empty, so downloads run at the full allowed rate and never faster.
+    """
     
-    if not os.path.exists('pdfs'):
-        os.makedirs('pdfs')
+    def __init__(self, rate=REQUESTS_PER_SECOND):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _retry_after(headers, attempt):
+    # Retry-After may also be an HTTP date; fall back to exponential backoff then
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return 2 ** attempt
+
+FeedEntry = namedtuple('FeedEntry', ['id', 'title'])
+
+def _parse_feed(content):
+    # Only the two fields that are used are read from the Atom feed, with the
+    # C-accelerated ElementTree parser
+    root = ET.fromstring(content)
+    return [
+        FeedEntry(entry.findtext('atom:id', '', ATOM_NS), entry.findtext('atom:title', '', ATOM_NS))
+        for entry in root.iterfind('atom:entry', ATOM_NS)
+    ]
+
+def download_arxiv_papers(search_query="operations research", max_articles=None, start=0, max_results=100, concurrency=DOWNLOAD_CONCURRENCY, output_dir="pdfs"):
+    base_url = "http://export.arxiv.org/api/query?"
     
-    article_count = 0
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
     
     query_params = {
         'search_query': search_query,
@@ -26,14 +105,29 @@ def download_arxiv_papers(search_query="operations research", max_articles=None,
     query_string = urllib.parse.urlencode(query_params)
     url = base_url + query_string
     
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Failed to query arXiv API: {response.status_code}")
-        return
+    # Query results are kept in the response cache for an hour, so re-running the
+    # same query doesn't hit the API again. PDFs are not cached; they are on disk
+    use_cache = cache.enabled()
+    key = cache.make_url_key(url)
+    content = cache.get(key) if use_cache else None
     
-    feed = feedparser.parse(response.content)
-    entries = feed.entries
+    if content is not None:
+        entries = _parse_feed(content.encode('utf-8'))
+    else:
+        response = SESSION.get(url, timeout=30)
+        
+        if response.status_code != 200:
+            print(f"Failed to query arXiv API: {response.status_code}")
+            return
+        
+        try:
+            entries = _parse_feed(response.content)
+        except ET.ParseError as e:
+            print(f"Failed to parse arXiv API response: {e}")
+            return
+        
+        if use_cache:
+            cache.set(key, response.content.decode('utf-8'), ttl=ARXIV_CACHE_TTL)
     
     if not entries:
         print(f"No papers found for query: {search_query}")
@@ -42,54 +136,171 @@ def download_arxiv_papers(search_query="operations research", max_articles=None,
     num_to_download = min(len(entries), max_articles) if max_articles else len(entries)
     pbar = tqdm(total=num_to_download, desc=f"Downloading papers for '{search_query}'")
     
+    downloaded, skipped = asyncio.run(_download_entries(entries, num_to_download, concurrency, output_dir, pbar))
+    
+    pbar.close()
+    return downloaded, skipped
+
+# Hidden so that the *.pdf listing of the directory doesn't include it
+MANIFEST_FILE = ".manifest.json"
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    
+    with open(manifest_path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, manifest_path)
+
+def _is_downloaded(output_dir, manifest, arxiv_id, filename):
+    # Papers in the manifest are found under the name they were saved with, even
+    # if their title has changed since; files from before the manifest existed are
+    # recognized by name
+    record = manifest.get(arxiv_id)
+    if record:
+        path = os.path.join(output_dir, record["filename"])
+        return os.path.exists(path) and os.path.getsize(path) == record["bytes"]
+    
+    return os.path.exists(filename) and os.path.getsize(filename) > 0
+
+def _entry_paths(entry, output_dir):
+    title = entry.title.replace('\n', ' ').strip()
+    arxiv_id = entry.id.split('/abs/')[-1]
+    
+    # HTTPS, since HTTP/2 is only negotiated over TLS
+    pdf_url = f"https://arxiv.org/pdf/{arxiv_id}.pdf"
+    
+    safe_filename = entry.title.translate(_SAFE_FILENAME_TABLE).strip()[:100]
+    
+    filename = os.path.join(output_dir, f"{safe_filename}.pdf")
+    return title, arxiv_id, pdf_url, filename
+
+async def _download_entries(entries, num_to_download, concurrency, output_dir, pbar):
+    manifest = load_manifest(output_dir)
+    
+    # Papers from earlier runs count towards the total without any request
+    pending = []
+    skipped = 0
     for entry in entries:
-        if max_articles and article_count >= max_articles:
-            break
-        
         try:
-            title = entry.title.replace('\n', ' ').strip()
-            arxiv_id = entry.id.split('/abs/')[-1]
-            
-            pdf_url = f"http://arxiv.org/pdf/{arxiv_id}.pdf"
-            
-            safe_filename = title.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            safe_filename = safe_filename[:100]
-            
-            filename = os.path.join('pdfs', f"{safe_filename}.pdf")
-            
-            pdf_response = requests.get(pdf_url)
-            
-            if pdf_response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    f.write(pdf_response.content)
-                article_count += 1
+            paths = _entry_paths(entry, output_dir)
+        except Exception as e:
+            pbar.write(f"Error processing paper: {e}")
+            continue
+        
+        _, arxiv_id, _, filename = paths
+        if _is_downloaded(output_dir, manifest, arxiv_id, filename):
+            if skipped < num_to_download:
+                skipped += 1
                 pbar.update(1)
-            else:
-                pbar.write(f"Failed to download PDF for '{title}': {pdf_response.status_code}")
-            
-            time.sleep(random.uniform(1, 3))
+        else:
+            pending.append(paths)
+    
+    if skipped:
+        pbar.write(f"Skipped {skipped} papers that were already downloaded")
+    
+    # Downloads run concurrently, with at most `concurrency` in flight and new
+    # requests started at no more than REQUESTS_PER_SECOND. Over HTTP/2 they are
+    # multiplexed on a single connection to arxiv.org instead of one each
+    semaphore = asyncio.Semaphore(concurrency)
+    settled = asyncio.Condition()
+    limiter = RateLimiter()
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS_PER_HOST, max_keepalive_connections=MAX_CONNECTIONS_PER_HOST)
+    state = {"downloaded": 0, "in_flight": 0}
+    
+    async with httpx.AsyncClient(http2=HTTP2, limits=limits, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True, headers={'User-Agent': USER_AGENT}) as client:
+        await asyncio.gather(*[
+            _download_entry(client, semaphore, settled, limiter, paths, num_to_download - skipped, output_dir, manifest, state, pbar)
+            for paths in pending
+        ])
+    
+    # Returned separately so that papers from earlier runs are not reported as downloaded
+    return state["downloaded"], skipped
+
+async def _download_entry(client, semaphore, settled, limiter, paths, remaining, output_dir, manifest, state, pbar):
+    title, arxiv_id, pdf_url, filename = paths
+    
+    async with semaphore:
+        # While the downloads in flight would cover the papers still missing (not
+        # counting those from earlier runs), wait for them to settle instead of
+        # giving up, so that a failed one is replaced by the next entry. Skip once
+        # enough papers are downloaded
+        async with settled:
+            await settled.wait_for(lambda: state["downloaded"] >= remaining or state["downloaded"] + state["in_flight"] < remaining)
+            if state["downloaded"] >= remaining:
+                return
+            state["in_flight"] += 1
+        
+        try:
+            for attempt in range(MAX_DOWNLOAD_RETRIES + 1):
+                await limiter.acquire()
+                
+                retry_delay = None
+                async with client.stream('GET', pdf_url, headers={'Accept-Encoding': 'identity'}) as pdf_response:
+                    if pdf_response.status_code == 200:
+                        # Stream the body to disk in 64 KiB chunks rather than holding the whole
+                        # PDF in memory, and only move it into place once it is complete
+                        part_filename = filename + '.part'
+                        digest = hashlib.sha256()
+                        size = 0
+                        with open(part_filename, 'wb') as f:
+                            async for chunk in pdf_response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                                digest.update(chunk)
+                                size += len(chunk)
+                        os.replace(part_filename, filename)
+                        
+                        manifest[arxiv_id] = {"filename": os.path.basename(filename), "sha256": digest.hexdigest(), "bytes": size}
+                        save_manifest(output_dir, manifest)
+                        
+                        state["downloaded"] += 1
+                        pbar.update(1)
+                    elif pdf_response.status_code in (429, 503) and attempt < MAX_DOWNLOAD_RETRIES:
+                        retry_delay = _retry_after(pdf_response.headers, attempt)
+                    else:
+                        pbar.write(f"Failed to download PDF for '{title}': {pdf_response.status_code}")
+                
+                if retry_delay is None:
+                    break
+                
+                pbar.write(f"arXiv returned {pdf_response.status_code} for '{title}', retrying in {retry_delay:.1f}s")
+                await asyncio.sleep(retry_delay)
             
         except Exception as e:
             pbar.write(f"Error processing paper: {e}")
+        finally:
+            async with settled:
+                state["in_flight"] -= 1
+                settled.notify_all()
+
+def main(search_queries=("operations research",), output_dir="pdfs", num_papers=10, concurrency=DOWNLOAD_CONCURRENCY):
+    total_downloaded = 0
+    total_skipped = 0
     
-    pbar.close()
-    return article_count
+    for query in search_queries:
+        counts = download_arxiv_papers(search_query=query, max_articles=num_papers, concurrency=concurrency, output_dir=output_dir)
+        if counts:
+            total_downloaded += counts[0]
+            total_skipped += counts[1]
+        time.sleep(5)
+    
+    print(f"\nTotal papers downloaded: {total_downloaded}")
+    print(f"Already downloaded in earlier runs: {total_skipped}")
+    return total_downloaded
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Download research papers from arXiv related to operations research.')
     parser.add_argument('--num_papers', type=int, default=10, help='Number of papers to download per query (default: 10)')
+    parser.add_argument('--concurrency', type=int, default=DOWNLOAD_CONCURRENCY, help=f'Number of PDFs to download at once (default: {DOWNLOAD_CONCURRENCY})')
+    parser.add_argument('--query', action='append', help="Search query; repeat for several queries (default: 'operations research')")
+    parser.add_argument('--output_dir', default='pdfs', help="Directory to save the PDFs to (default: 'pdfs')")
     args = parser.parse_args()
     
-    search_queries = [
-        "operations research",
-    ]
-    
-    total_downloaded = 0
-    
-    for query in search_queries:
-        downloaded = download_arxiv_papers(search_query=query, max_articles=args.num_papers)
-        if downloaded:
-            total_downloaded += downloaded
-        time.sleep(5)
-    
-    print(f"\nTotal papers downloaded: {total_downloaded}")
\ No newline at end of file
+    main(args.query or ["operations research"], args.output_dir, args.num_papers, args.concurrency)
@@ -1,48 +1,141 @@
 import os
+import mmap
+import hashlib
 import argparse
-import json
+import asyncio
+import orjson
 import time
-from openai import OpenAI
+from concurrent.futures import ProcessPoolExecutor
+from openai import OpenAI, AsyncOpenAI
 
-def validate_jsonl_file(file_path):
+_ROLES = frozenset({'system', 'user', 'assistant'})
+TERMINAL_STATUSES = frozenset({"succeeded", "failed", "cancelled"})
+POLL_INTERVAL = 30
+MAX_POLL_INTERVAL = 120
+PARALLEL_VALIDATION_BYTES = 64 << 20
+
+# Validates the lines in data[start:end], where data is bytes or an mmap, hashing
+# each line on the way so duplicates can be found without reading the file again.
+# Returns (digests, error), with error None or (line number within the range, message)
+def _validate_lines(data, start, end):
+    digests = []
+    pos = start
+    while pos < end:
+        newline = data.find(b'\n', pos, end)
+        if newline == -1:
+            newline = end
+        line = data[pos:newline]
+        pos = newline + 1
+        digests.append(hashlib.blake2b(line, digest_size=16).digest())
+        
+        # Lines are parsed straight from bytes, skipping the text decode
+        try:
+            example = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return digests, (len(digests), ": Invalid JSON")
+        
+        if 'messages' not in example:
+            return digests, (len(digests), ": Missing 'messages' field")
+        
+        if not isinstance(example['messages'], list) or len(example['messages']) < 2:
+            return digests, (len(digests), ": 'messages' must be a list with at least 2 messages")
+        
+        for i, msg in enumerate(example['messages']):
+            if 'role' not in msg or 'content' not in msg:
+                return digests, (len(digests), f", message {i}: Missing 'role' or 'content'")
+            
+            if msg['role'] not in _ROLES:
+                return digests, (len(digests), f", message {i}: Invalid role '{msg['role']}'")
+    
+    return digests, None
+
+# Maps the file and validates data[start:end]; as a process pool worker only the
+# offsets are sent to it, not the bytes
+def _validate_range(file_path, start, end):
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _validate_lines(mm, start, end)
+
+# Splits data into up to `shards` byte ranges that end at line boundaries
+def _shard_ranges(data, shards):
+    bounds = [0]
+    for k in range(1, shards):
+        newline = data.find(b'\n', max(bounds[-1], len(data) * k // shards))
+        if newline == -1:
+            break
+        bounds.append(newline + 1)
+    bounds.append(len(data))
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+# Validates the file over an mmap, so its lines are read from the page cache rather
+# than copied into memory. Files above PARALLEL_VALIDATION_BYTES are validated in
+# shards on a process pool, each worker mapping the file itself. Returns the
+# blake2b digest of every line, or None if validation fails
+def validate_and_hash_jsonl(file_path, workers=None):
     print(f"Validating file: {file_path}")
     
-    with open(file_path, 'r') as f:
-        line_count = 0
-        for line_num, line in enumerate(f, 1):
-            try:
-                data = json.loads(line)
-                line_count += 1
-                
-                if 'messages' not in data:
-                    print(f"Error on line {line_num}: Missing 'messages' field")
-                    return False
-                
-                if not isinstance(data['messages'], list) or len(data['messages']) < 2:
-                    print(f"Error on line {line_num}: 'messages' must be a list with at least 2 messages")
-                    return False
-                
-                for i, msg in enumerate(data['messages']):
-                    if 'role' not in msg or 'content' not in msg:
-                        print(f"Error on line {line_num}, message {i}: Missing 'role' or 'content'")
-                        return False
-                    
-                    if msg['role'] not in ['system', 'user', 'assistant']:
-                        print(f"Error on line {line_num}, message {i}: Invalid role '{msg['role']}'")
-                        return False
-            
-            except json.JSONDecodeError:
-                print(f"Error on line {line_num}: Invalid JSON")
-                return False
+    size = os.path.getsize(file_path)
+    if size == 0:
+        results = [([], None)]
+    elif size < PARALLEL_VALIDATION_BYTES:
+        results = [_validate_range(file_path, 0, size)]
+    else:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ranges = _shard_ranges(mm, workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            results = list(executor.map(_validate_range, [file_path] * len(ranges), *zip(*ranges)))
+    
+    digests = []
+    for shard_digests, error in results:
+        if error:
+            line_num, message = error
+            print(f"Error on line {len(digests) + line_num}{message}")
+            return None
+        digests.extend(shard_digests)
     
-    print(f"Validation successful. File contains {line_count} valid examples.")
-    return True
+    print(f"Validation successful. File contains {len(digests)} valid examples.")
+    return digests
 
+def validate_jsonl_file(file_path, workers=None):
+    return validate_and_hash_jsonl(file_path, workers) is not None
+
+# Drops repeated training examples, keeping the first occurrence of each line.
+# format_data.py serializes examples deterministically, so identical examples are
+# identical lines, and the digests come from validation. Returns the path to
+# upload: the input itself when nothing is repeated, otherwise a <name>.dedup.jsonl
+# written next to it, which is the only case where the file is read again
+def dedupe_jsonl_file(file_path, digests):
+    seen = set()
+    keep = []
+    for digest in digests:
+        keep.append(digest not in seen)
+        seen.add(digest)
+    
+    duplicates = len(keep) - len(seen)
+    print(f"Found {duplicates} duplicate examples out of {len(keep)} ({duplicates / max(len(keep), 1):.1%})")
+    if not duplicates:
+        return file_path
+    
+    dedup_path = f"{os.path.splitext(file_path)[0]}.dedup.jsonl"
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, open(dedup_path, 'wb', buffering=1 << 20) as out:
+        pos = 0
+        for kept in keep:
+            newline = mm.find(b'\n', pos)
+            end = len(mm) if newline == -1 else newline
+            if kept:
+                out.write(mm[pos:end])
+                out.write(b'\n')
+            pos = end + 1
+    
+    print(f"Wrote {len(seen)} unique examples to {dedup_path}")
+    return dedup_path
+
+# The open file is passed to the client as is, which streams it into the multipart
+# body in chunks instead of reading it into memory first
 def upload_file(client, file_path):
     try:
-        with open(file_path, "rb") as file:
+        with open(file_path, "rb") as f:
             response = client.files.create(
-                file=file,
+                file=(os.path.basename(file_path), f, "application/jsonl"),
                 purpose="fine-tune"
             )
         print(f"File uploaded successfully. File ID: {response.id}")
@@ -76,24 +169,50 @@ def create_fine_tuning_job(client, file_id, model="gpt-4o-2024-08-06", suffix=No
         print(f"Error creating fine-tuning job: {e}")
         return None
 
+def print_job_status(response):
+    print(f"Job ID: {response.id}")
+    print(f"Status: {response.status}")
+    print(f"Created at: {response.created_at}")
+    print(f"Finished at: {response.finished_at or 'Not finished yet'}")
+    print(f"Fine-tuned model: {response.fine_tuned_model or 'Not available yet'}")
+    
+    if response.error:
+        print(f"Error: {response.error}")
+
 def check_fine_tuning_status(client, job_id):
     try:
         response = client.fine_tuning.jobs.retrieve(job_id)
-        
-        print(f"Job ID: {response.id}")
-        print(f"Status: {response.status}")
-        print(f"Created at: {response.created_at}")
-        print(f"Finished at: {response.finished_at or 'Not finished yet'}")
-        print(f"Fine-tuned model: {response.fine_tuned_model or 'Not available yet'}")
-        
-        if response.error:
-            print(f"Error: {response.error}")
-        
+        print_job_status(response)
         return response.status
     except Exception as e:
         print(f"Error checking fine-tuning status: {e}")
         return None
 
+# Polls a job until it finishes without blocking the event loop, so several jobs
+# can be monitored at once. The interval doubles after each check up to max_poll;
+# rate-limit and server errors are retried by the client itself
+async def await_job(client, job_id, poll=POLL_INTERVAL, max_poll=MAX_POLL_INTERVAL):
+    while True:
+        try:
+            response = await client.fine_tuning.jobs.retrieve(job_id)
+            print_job_status(response)
+            
+            if response.status in TERMINAL_STATUSES:
+                print(f"Fine-tuning job {job_id} {response.status}.")
+                if response.status == "succeeded":
+                    print(f"Fine-tuned model name: {response.fine_tuned_model}")
+                return response.status
+        except Exception as e:
+            print(f"Error checking fine-tuning status: {e}")
+        
+        print(f"Waiting {poll} seconds before checking job {job_id} again...")
+        await asyncio.sleep(poll)
+        poll = min(poll * 2, max_poll)
+
+async def await_jobs(api_key, job_ids):
+    client = AsyncOpenAI(api_key=api_key, max_retries=5)
+    return await asyncio.gather(*[await_job(client, job_id) for job_id in job_ids])
+
 def run_fine_tuning(api_key=None, input_file="combined_dataset.jsonl", model="gpt-4o-2024-08-06", suffix=None, wait=False, epochs=3):
     if not api_key:
         api_key = os.environ.get("OPENAI_API_KEY")
@@ -103,11 +222,13 @@ def run_fine_tuning(api_key=None, input_file="combined_dataset.jsonl", model="gp
     
     client = OpenAI(api_key=api_key)
     
-    if not validate_jsonl_file(input_file):
+    digests = validate_and_hash_jsonl(input_file)
+    if digests is None:
         print("File validation failed. Please fix the issues and try again.")
         return
     
-    file_id = upload_file(client, input_file)
+    upload_path = dedupe_jsonl_file(input_file, digests)
+    file_id = upload_file(client, upload_path)
     if not file_id:
         print("File upload failed. Aborting fine-tuning.")
         return
@@ -122,34 +243,28 @@ def run_fine_tuning(api_key=None, input_file="combined_dataset.jsonl", model="gp
     
     if wait:
         print("Monitoring fine-tuning job status...")
-        status = None
-        while status not in ["succeeded", "failed", "cancelled"]:
-            status = check_fine_tuning_status(client, job_id)
-            if status in ["succeeded", "failed", "cancelled"]:
-                break
-            print("Waiting 60 seconds before checking again...")
-            time.sleep(60)
-        
-        print(f"Fine-tuning job {status}.")
-        if status == "succeeded":
-            response = client.fine_tuning.jobs.retrieve(job_id)
-            print(f"Fine-tuned model name: {response.fine_tuned_model}")
+        asyncio.run(await_jobs(api_key, [job_id]))
     else:
         print("Fine-tuning job started. You can check its status later with:")
         print(f"  python sft.py --check_status {job_id}")
 
-def check_job_status(api_key=None, job_id=None):
+def check_job_status(api_key=None, job_ids=None, wait=False):
     if not api_key:
         api_key = os.environ.get("OPENAI_API_KEY")
     
     if not api_key:
         raise ValueError("OpenAI API key not provided. Please set OPENAI_API_KEY environment variable or use the --api_key argument.")
     
-    if not job_id:
+    if not job_ids:
         raise ValueError("Job ID not provided. Please use the --check_status argument.")
     
+    if wait:
+        asyncio.run(await_jobs(api_key, job_ids))
+        return
+    
     client = OpenAI(api_key=api_key)
-    check_fine_tuning_status(client, job_id)
+    for job_id in job_ids:
+        check_fine_tuning_status(client, job_id)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fine-tune GPT-4o on mathematical reasoning data")
@@ -158,12 +273,12 @@ if __name__ == "__main__":
     parser.add_argument("--model", default="gpt-4o-2024-08-06", help="Base model to fine-tune")
     parser.add_argument("--suffix", help="Custom suffix for the fine-tuned model name")
     parser.add_argument("--wait", action="store_true", help="Wait and monitor the fine-tuning job until completion")
-    parser.add_argument("--check_status", help="Check the status of an existing fine-tuning job by ID")
+    parser.add_argument("--check_status", nargs="+", help="Check the status of existing fine-tuning jobs by ID; with --wait, monitor them until they finish")
     parser.add_argument("--epochs", type=int, default=3, help="Number of epochs for fine-tuning (default: 3)")
     
     args = parser.parse_args()
     
     if args.check_status:
-        check_job_status(args.api_key, args.check_status)
+        check_job_status(args.api_key, args.check_status, args.wait)
     else:
         run_fine_tuning(args.api_key, args.input_file, args.model, args.suffix, args.wait, args.epochs) 
\ No newline at end of file
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import extract_traces
+
+
+def _completion_response(content):
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }]
+    })
+
+
+def test_metadata_extraction_goes_through_the_sdk_parse_method(monkeypatch):
+    # A mock transport keeps the real SDK call path, so a missing client attribute
+    # would surface as an empty result instead of passing silently
+    monkeypatch.setenv("LLM_CACHE_ENABLED", "0")
+    metadata = {"title": "T", "field": "Optimization", "contributions": ["c"], "named_elements": ["Theorem 1"]}
+    requests = []
+    
+    def handler(request):
+        requests.append(request)
+        return _completion_response(json.dumps(metadata))
+    
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = extract_traces.ThrottledClient(AsyncOpenAI(api_key="test", http_client=http_client))
+    
+    result = asyncio.run(extract_traces.extract_paper_metadata("Some paper text", client))
+    
+    assert result == metadata
+    assert len(requests) == 1
+    assert requests[0].url.path.endswith("/chat/completions")
+    assert json.loads(requests[0].content)["response_format"]["type"] == "json_schema"
+
+
+class _ByteEncoding:
+    def encode(self, text):
+        return list(text.encode())
+    
+    def decode(self, tokens):
+        return bytes(tokens).decode(errors="ignore")
+
+
+def test_failed_extraction_is_not_cached(monkeypatch, tmp_path):
+    # Every request is rejected; the PDF must fail rather than cache an empty result
+    monkeypatch.setenv("LLM_CACHE_ENABLED", "1")
+    monkeypatch.setattr(extract_traces.cache, "CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(extract_traces.cache, "_conn", None)
+    monkeypatch.setattr(extract_traces, "_get_encoding", _ByteEncoding)
+    monkeypatch.setattr(extract_traces, "extract_text_from_pdf", lambda pdf_path, page_workers=1: "A short paper about a theorem.")
+    
+    pdf_path = tmp_path / "paper.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 test")
+    trace_cache_dir = tmp_path / "traces"
+    
+    def handler(request):
+        return httpx.Response(401, json={"error": {"message": "Incorrect API key", "type": "invalid_request_error", "code": "invalid_api_key"}})
+    
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = extract_traces.ThrottledClient(AsyncOpenAI(api_key="test", http_client=http_client, max_retries=0))
+    
+    with pytest.raises(extract_traces.ExtractionError):
+        asyncio.run(extract_traces.process_pdf_async(str(pdf_path), str(tmp_path / "out"), 1, api_key="test", client=client, trace_cache_dir=str(trace_cache_dir)))
+    
+    assert not trace_cache_dir.exists() or not any(trace_cache_dir.iterdir())
+    assert not (tmp_path / "out" / "output1.json").exists()